@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import registry  # noqa: E402
+from storage import SQLiteBackend, frame_to_records  # noqa: E402
+from synthetic import generate_registry  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+# Run fn `runs` times; returns the timings in milliseconds
+def _time(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+# Peak Python-heap allocation (numpy buffers included) while running fn once
+def _peak_mb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+    finally:
+        tracemalloc.stop()
+
+def _result(size, scenario, timings, **extra):
+    return {
+        "size": size,
+        "scenario": scenario,
+        "runs": len(timings),
+        "p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "p95_ms": round(float(np.percentile(timings, 95)), 3),
+        "mean_ms": round(float(np.mean(timings)), 3),
+        **extra,
+    }
+
+def _visit(rng, mrn):
+    return {
+        "MRN": mrn, "Date_of_Birth": "1955-03-04", "Follow_up_date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "Histology": ["Renal Cell Carcinoma"], "Grade": "II", "Dose": ["26Gy"], "Fractionation": ["1"], "Hematuria": "I",
+    }
+
+
+def _cold_load(database, snapshot):
+    registry.configure(snapshot=snapshot)
+    store = registry.RegistryStore(SQLiteBackend(database))
+    try:
+        store.data()
+    finally:
+        store.writer.close()
+
+
+# Every scenario against a fresh registry of `size` visits
+def bench_size(size, workdir, args):
+    database = os.path.join(workdir, f"bench_{size}.db")
+    snapshot = os.path.join(workdir, f"bench_{size}.parquet")
+    for path in [database, database + "-wal", database + "-shm", snapshot]:
+        if os.path.exists(path):
+            os.remove(path)
+
+    start = time.perf_counter()
+    df = generate_registry(size, seed=args.seed)
+    backend = SQLiteBackend(database)
+    for first in range(0, len(df), 50_000):
+        backend.append(frame_to_records(df.iloc[first:first + 50_000]))
+    setup_seconds = round(time.perf_counter() - start, 2)
+    mrns = df["MRN"].unique().tolist()
+    del df
+
+    results = []
+    loads = max(1, args.runs // 4)
+
+    # load_data: raw rows straight from storage, as the original app read them
+    registry.configure(database=database, snapshot="")
+    timings = _time(registry.load_data, loads)
+    results.append(_result(size, "load_data", timings, peak_mb=_peak_mb(registry.load_data), setup_seconds=setup_seconds))
+
+    timings = _time(lambda: _cold_load(database, ""), loads)
+    results.append(_result(size, "cold_load", timings, peak_mb=_peak_mb(lambda: _cold_load(database, ""))))
+
+    _cold_load(database, snapshot)  # writes the snapshot
+    timings = _time(lambda: _cold_load(database, snapshot), loads)
+    results.append(_result(size, "cold_load_snapshot", timings, peak_mb=_peak_mb(lambda: _cold_load(database, snapshot))))
+
+    registry.configure(database=database, snapshot=snapshot)
+    store = registry.get_registry_store()
+    store.data()
+    rng = random.Random(args.seed)
+
+    sample = [rng.choice(mrns) for _ in range(args.runs * 10)]
+    timings = _time(lambda: registry.get_patient_data(sample.pop()), len(sample))
+    results.append(_result(size, "mrn_lookup", timings))
+
+    timings = _time(lambda: registry.save_data(_visit(rng, rng.choice(mrns))), args.runs)
+    results.append(_result(size, "single_save", timings))
+
+    # Concurrent saves: every thread saves `saves` visits; no row may be lost
+    before = len(store.backend)
+    latencies = []
+    lock = threading.Lock()
+
+    def session(seed):
+        session_rng = random.Random(seed)
+        for _ in range(args.saves):
+            start = time.perf_counter()
+            registry.save_data(_visit(session_rng, session_rng.choice(mrns)))
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(args.seed + i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    expected = args.threads * args.saves
+    written = len(store.backend) - before
+    results.append(_result(
+        size, "concurrent_saves", latencies, threads=args.threads, rows_expected=expected, rows_written=written,
+        saves_per_second=round(expected / elapsed, 1),
+    ))
+    if written != expected:
+        print(f"  concurrent_saves: {written} rows written for {expected} saves", file=sys.stderr)
+
+    if not args.skip_app:
+        results.append(bench_app(size, rng, mrns, args))
+
+    for result in results:
+        result["max_rss_mb"] = _max_rss_mb()
+    return results
+
+# End-to-end rerun of the form script: enter an MRN, prefill, render
+def bench_app(size, rng, mrns, args):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"), default_timeout=120)
+    app.run()
+    timings = []
+    for _ in range(args.runs):
+        app.text_input(key="mrn").set_value(rng.choice(mrns))
+        start = time.perf_counter()
+        app.run()
+        timings.append((time.perf_counter() - start) * 1000)
+        if app.exception:
+            raise RuntimeError(f"app raised: {app.exception[0].value}")
+    return _result(size, "app_rerun", timings)
+
+
+# Scenarios whose p50 grew by more than `tolerance` over the baseline file
+def regressions(results, baseline_file, tolerance):
+    with open(baseline_file) as f:
+        baseline = {(item["size"], item["scenario"]): item for item in json.load(f)["results"]}
+    slower = []
+    for result in results:
+        before = baseline.get((result["size"], result["scenario"]))
+        if before and result["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+            slower.append((result["size"], result["scenario"], before["p50_ms"], result["p50_ms"]))
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the registry data paths on synthetic registries.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated visit counts (up to 1000000)")
+    parser.add_argument("--runs", type=int, default=20, help="timed repetitions per scenario")
+    parser.add_argument("--threads", type=int, default=16, help="sessions saving at once")
+    parser.add_argument("--saves", type=int, default=10, help="saves per concurrent session")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-app", action="store_true", help="skip the AppTest rerun scenario")
+    parser.add_argument("--workdir", help="where the benchmark databases go (default: a temporary directory)")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare p50 against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown over the baseline")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="registry-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"{size} visits")
+        for result in bench_size(size, workdir, args):
+            print(f"  {result['scenario']:<20} p50 {result['p50_ms']:>10.2f} ms   p95 {result['p95_ms']:>10.2f} ms")
+            results.append(result)
+
+    with open(args.out, "w") as f:
+        json.dump({
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "environment": {
+                "python": platform.python_version(), "platform": platform.platform(),
+                "pandas": pd.__version__, "numpy": np.__version__, "cpus": os.cpu_count(),
+            },
+            "results": results,
+        }, f, indent=2)
+    print(f"results written to {args.out}")
+
+    failed = any(result.get("rows_written") != result.get("rows_expected") for result in results)
+    if args.baseline:
+        slower = regressions(results, args.baseline, args.tolerance)
+        for size, scenario, before, after in slower:
+            print(f"REGRESSION {scenario} at {size} visits: p50 {before:.2f} ms -> {after:.2f} ms")
+        failed = failed or bool(slower)
+    sys.exit(1 if failed else 0)
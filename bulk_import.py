@@ -0,0 +1,187 @@
+import argparse
+import os
+import re
+from collections import namedtuple
+
+import openpyxl
+import pandas as pd
+
+from registry_schema import CATEGORIES, DATE_COLUMNS, LIST_OPTIONS, NUMERIC_COLUMNS, REGISTRY_COLUMNS
+from storage import SQLiteBackend
+
+ImportSummary = namedtuple("ImportSummary", ["rows", "imported", "rejected", "unmapped_columns"])
+
+# Spellings seen in older spreadsheets, after header normalization (see _header_key)
+COLUMN_ALIASES = {
+    "medical_record_number": "MRN",
+    "dob": "Date_of_Birth",
+    "birth_date": "Date_of_Birth",
+    "last_radiotherapy": "Date_of_Last_Radiotherapy",
+    "date_of_last_rt": "Date_of_Last_Radiotherapy",
+    "follow_up": "Follow_up_date",
+    "date_of_follow_up": "Follow_up_date",
+    "overall_tolerance": "Overal_tolerance",
+    "cancer_related_death": "Cancer Related Death",
+}
+
+# Cells that mean "nothing recorded"
+MISSING_VALUES = {"", "n/a", "na", "nan", "none", "null", "-"}
+
+
+def _header_key(name):
+    return re.sub(r"[^a-z0-9]+", "_", str(name).strip().lower()).strip("_")
+
+_KNOWN_COLUMNS = {_header_key(column): column for column in [*REGISTRY_COLUMNS, *NUMERIC_COLUMNS, "Cancer Related Death"]}
+
+# Map source headers onto registry columns; returns (renames, unmapped headers)
+def map_columns(headers):
+    renames, unmapped = {}, []
+    for header in headers:
+        key = _header_key(header)
+        column = _KNOWN_COLUMNS.get(key) or COLUMN_ALIASES.get(key)
+        if column and column not in renames.values():
+            renames[header] = column
+        else:
+            unmapped.append(header)
+    return renames, unmapped
+
+
+# Read a CSV or workbook in chunks of text cells, never holding the whole file
+def iter_chunks(path, chunk_size=10_000):
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(value) if value is not None else "" for value in next(rows, [])]
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield pd.DataFrame(chunk, columns=header)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame(chunk, columns=header)
+        finally:
+            workbook.close()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+
+
+def _stripped(values):
+    return values.astype(object).where(values.notna(), "").astype(str).str.strip()
+
+def _text(values):
+    text = _stripped(values)
+    return text.where(~text.str.lower().isin(MISSING_VALUES), "")
+
+# "['a', 'b']" as saved by the app, or "a; b" / "a, b" as typed by hand, to the
+# stored list form; None if any item is not a form option
+def _list_cell(text, canonical):
+    items = [item for item in re.split(r"\s*[;,]\s*", re.sub(r"[\[\]'\"]", "", text)) if item]
+    matched = [canonical.get(item.lower()) for item in items]
+    return None if None in matched else str(matched)
+
+def _add_error(errors, mask, message):
+    errors[mask] = errors[mask] + message + "; "
+
+
+# Normalize and validate one chunk. Returns (accepted frame, rejected frame);
+# rejected rows keep their original cells plus Source_row and Errors columns.
+def validate_chunk(chunk, renames, first_row=2, dayfirst=False):
+    source = chunk.rename(columns=renames)[list(renames.values())]
+    out = pd.DataFrame(index=chunk.index)
+    errors = pd.Series("", index=chunk.index, dtype=object)
+
+    if "MRN" in source:
+        mrn = _text(source["MRN"]).str.replace(r"\.0$", "", regex=True)
+    else:
+        mrn = pd.Series("", index=chunk.index)
+    _add_error(errors, mrn == "", "missing MRN")
+    out["MRN"] = mrn
+
+    for column in source.columns:
+        if column == "MRN":
+            continue
+        text = _text(source[column])
+        present = text != ""
+        if column in DATE_COLUMNS:
+            parsed = pd.to_datetime(source[column].where(present), errors="coerce", format="mixed", dayfirst=dayfirst)
+            _add_error(errors, present & parsed.isna(), f"{column}: not a date")
+            out[column] = parsed.dt.strftime("%Y-%m-%d").where(parsed.notna(), None)
+        elif column in NUMERIC_COLUMNS:
+            parsed = pd.to_numeric(text.where(present), errors="coerce")
+            _add_error(errors, present & parsed.isna(), f"{column}: not a number")
+            if (parsed.dropna() % 1 == 0).all():
+                parsed = parsed.astype("Int64")
+            out[column] = parsed.astype(object).where(parsed.notna(), None)
+        # Options are matched before missing markers, since some vocabularies
+        # have a "None" option (grade 0) that must not read as an empty cell
+        elif column in CATEGORIES:
+            canonical = {value.lower(): value for value in CATEGORIES[column]}
+            matched = _stripped(source[column]).str.lower().map(canonical)
+            present |= matched.notna()
+            _add_error(errors, present & matched.isna(), f"{column}: not one of the form options")
+            out[column] = matched.where(present, None)
+        elif column in LIST_OPTIONS:
+            canonical = {value.lower(): value for value in LIST_OPTIONS[column]}
+            stored = _stripped(source[column]).map(lambda value: _list_cell(value, canonical) if value else None)
+            present |= stored.notna()
+            _add_error(errors, present & stored.isna(), f"{column}: not one of the form options")
+            out[column] = stored.where(present, None)
+        else:
+            out[column] = text.where(present, None)
+
+    rejected_mask = errors != ""
+    rejected = chunk[rejected_mask].copy()
+    rejected.insert(0, "Source_row", first_row + rejected.index)
+    rejected["Errors"] = errors[rejected_mask].str.rstrip("; ")
+    return out[~rejected_mask], rejected
+
+
+# Stream a file into the registry one chunk (one transaction) at a time.
+# append(rows, authors) stores a chunk: backend.append, or
+# RegistryStore.append_rows to go through the app's single writer.
+# Rejected rows are appended to errors_file as CSV; progress(rows_done) is
+# called after every chunk.
+def import_file(path, append, errors_file=None, chunk_size=10_000, dayfirst=False, progress=None):
+    rows = imported = rejected = 0
+    renames = unmapped = None
+    if errors_file and os.path.exists(errors_file):
+        os.remove(errors_file)
+    for chunk in iter_chunks(path, chunk_size):
+        if renames is None:
+            renames, unmapped = map_columns(chunk.columns)
+        accepted, bad = validate_chunk(chunk.reset_index(drop=True), renames, first_row=rows + 2, dayfirst=dayfirst)
+        # The audit trail names the file the rows came from
+        append(accepted.to_dict("records"), [f"import of {os.path.basename(path)}"] * len(accepted))
+        if errors_file and len(bad):
+            bad.to_csv(errors_file, mode="a", header=not os.path.exists(errors_file), index=False)
+        rows += len(chunk)
+        imported += len(accepted)
+        rejected += len(bad)
+        if progress:
+            progress(rows)
+    return ImportSummary(rows, imported, rejected, unmapped or [])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import historical spreadsheets or CSV files into the registry.")
+    parser.add_argument("source", help=".xlsx or .csv file")
+    parser.add_argument("--database", default="registry.db")
+    parser.add_argument("--errors", default="import_errors.csv", help="CSV report of rejected rows")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--dayfirst", action="store_true", help="read ambiguous dates as DD/MM/YYYY")
+    args = parser.parse_args()
+
+    summary = import_file(
+        args.source,
+        SQLiteBackend(args.database).append,
+        errors_file=args.errors,
+        chunk_size=args.chunk_size,
+        dayfirst=args.dayfirst,
+        progress=lambda done: print(f"\r{done} rows read", end="", flush=True),
+    )
+    print()
+    print(f"imported {summary.imported} of {summary.rows} rows, rejected {summary.rejected} (see {args.errors})")
+    if summary.unmapped_columns:
+        print("ignored columns:", ", ".join(map(str, summary.unmapped_columns)))
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from registry_schema import CATEGORIES, CTCAE_COLUMNS, EVENT_COLUMNS
+
+
+# Vectorized calculate_months: whole calendar months between two datetime columns
+def months_between(start, end):
+    return (end.dt.year - start.dt.year) * 12 + (end.dt.month - start.dt.month)
+
+# Completed years between two datetime columns
+def years_between(start, end):
+    before_birthday = (end.dt.month < start.dt.month) | ((end.dt.month == start.dt.month) & (end.dt.day < start.dt.day))
+    return end.dt.year - start.dt.year - before_birthday.astype("Int64")
+
+def _first_present(df, columns):
+    result = pd.Series(pd.NA, index=df.index, dtype="Float64")
+    for column in columns:
+        if column in df:
+            result = result.fillna(pd.to_numeric(df[column], errors="coerce").astype("Float64"))
+    return result
+
+
+# One row per patient with age, follow-up and time-to-event in months.
+# Times to an event come from the months stored with the first visit that
+# reported it, or from that visit's follow-up date when none was stored;
+# patients without the event are censored at their last follow-up.
+def patient_outcomes(df):
+    visits = df.sort_values(["MRN", "Follow_up_date"], kind="stable")
+    dates = visits[["MRN", "Date_of_Birth", "Date_of_Last_Radiotherapy", "Follow_up_date"]]
+    by_patient = dates.groupby("MRN", sort=True)
+    outcomes = pd.DataFrame({
+        "Date_of_Birth": by_patient["Date_of_Birth"].last(),
+        "Date_of_Last_Radiotherapy": by_patient["Date_of_Last_Radiotherapy"].last(),
+        "Last_follow_up": by_patient["Follow_up_date"].max(),
+        "Visits": by_patient.size(),
+    })
+    outcomes["Age"] = years_between(outcomes["Date_of_Birth"], outcomes["Last_follow_up"])
+    outcomes["Follow_up_months"] = months_between(outcomes["Date_of_Last_Radiotherapy"], outcomes["Last_follow_up"])
+
+    for flag, time_columns in EVENT_COLUMNS.items():
+        name = flag.lower()
+        if flag not in visits:
+            outcomes[name] = False
+            outcomes[f"time_to_{name}"] = pd.NA
+            continue
+        stored_columns = [column for column in time_columns if column in visits]
+        with_event = visits.loc[visits[flag].astype(object) == "Yes", ["MRN", "Follow_up_date", *stored_columns]]
+        first = with_event.drop_duplicates("MRN").set_index("MRN")
+        stored = _first_present(first, stored_columns)
+        rt_date = outcomes["Date_of_Last_Radiotherapy"].reindex(first.index)
+        computed = months_between(rt_date, first["Follow_up_date"]).astype("Float64")
+        outcomes[name] = outcomes.index.isin(first.index)
+        outcomes[f"time_to_{name}"] = stored.fillna(computed).reindex(outcomes.index)
+    return outcomes.reset_index()
+
+
+# Kaplan-Meier estimate for one endpoint: event flags and the months to the
+# event (or to censoring). Returns one row per distinct event time.
+def kaplan_meier(time, event):
+    time = pd.to_numeric(time, errors="coerce").to_numpy(dtype=float)
+    event = np.asarray(event, dtype=bool)
+    known = ~np.isnan(time)
+    time, event = time[known], event[known]
+    if not len(time):
+        return pd.DataFrame({"Months": [0.0], "Survival": [1.0], "At_risk": [0], "Events": [0]})
+    sorted_times = np.sort(time)
+    event_times, events = np.unique(time[event], return_counts=True)
+    at_risk = len(time) - np.searchsorted(sorted_times, event_times, side="left")
+    survival = np.cumprod(1.0 - events / at_risk)
+    return pd.DataFrame({
+        "Months": np.r_[0.0, event_times],
+        "Survival": np.r_[1.0, survival],
+        "At_risk": np.r_[len(time), at_risk],
+        "Events": np.r_[0, events],
+    })
+
+# Time to event where it happened, otherwise follow-up time (censored)
+def endpoint(outcomes, name):
+    event = outcomes[name].to_numpy(dtype=bool)
+    time = outcomes[f"time_to_{name}"].astype("Float64").where(event, outcomes["Follow_up_months"].astype("Float64"))
+    return time, event
+
+def local_control_curve(outcomes):
+    return kaplan_meier(*endpoint(outcomes, "local_recurrence"))
+
+def overall_survival_curve(outcomes):
+    return kaplan_meier(*endpoint(outcomes, "death"))
+
+
+# Worst grade per patient for every CTCAE column, with the patient's latest
+# dose and fractionation, exploded to one row per (dose, fractionation) pair
+def worst_grades(df):
+    patient, mrns = pd.factorize(df["MRN"], sort=True)
+    columns = [column for column in CTCAE_COLUMNS if column in df]
+    # Only vocabulary values have a rank; anything else counts as not graded
+    codes = pd.DataFrame({
+        column: df[column].cat.codes.where(df[column].cat.codes < len(CATEGORIES[column]), -1).to_numpy()
+        for column in columns
+    })
+    highest = codes.groupby(patient).max()
+    worst = pd.DataFrame(index=pd.Index(mrns, name="MRN"))
+    for column in columns:
+        worst[column] = pd.Categorical.from_codes(highest[column].to_numpy(), categories=CATEGORIES[column])
+
+    visits = df.sort_values("Follow_up_date", kind="stable")
+    for column in ["Dose", "Fractionation"]:
+        latest = pd.Series(index=worst.index, dtype=object)
+        if column in visits:
+            recorded = visits.loc[visits[column].notna(), ["MRN", column]].drop_duplicates("MRN", keep="last")
+            latest = recorded.set_index("MRN")[column].astype(object).reindex(worst.index)
+        worst[column] = [list(values) if isinstance(values, (list, np.ndarray)) and len(values) else ["Not recorded"] for values in latest]
+    return worst.explode("Dose").explode("Fractionation").reset_index()
+
+# Patients by worst grade of one toxicity, per dose and fractionation
+def toxicity_incidence(grades, toxicity):
+    table = pd.crosstab([grades["Dose"], grades["Fractionation"]], grades[toxicity], dropna=False)
+    table["Patients"] = table.sum(axis=1)
+    return table[table["Patients"] > 0]
+
+# Share of patients with grade >= min_grade of each toxicity, per dose and fractionation
+def toxicity_rates(grades, min_grade="II"):
+    rates = {}
+    keys = [grades["Dose"], grades["Fractionation"]]
+    for column in CTCAE_COLUMNS:
+        if column not in grades:
+            continue
+        vocabulary = CATEGORIES[column]
+        threshold = vocabulary.index(min_grade) if min_grade in vocabulary else len(vocabulary)
+        reached = grades[column].cat.codes >= threshold
+        rates[column] = reached.groupby(keys).mean()
+    table = pd.DataFrame(rates)
+    table["Patients"] = grades.groupby(["Dose", "Fractionation"]).size()
+    return table
+
+
+# Everything the analytics page shows, computed once per registry state;
+# registry_version must tell registries and their states apart
+@st.cache_data(max_entries=4, show_spinner="Computing cohort outcomes...")
+def cohort_report(registry_version, _df):
+    outcomes = patient_outcomes(_df)
+    grades = worst_grades(_df)
+    return {
+        "outcomes": outcomes,
+        "outcomes_csv": outcomes.to_csv(index=False),
+        "local_control": local_control_curve(outcomes),
+        "overall_survival": overall_survival_curve(outcomes),
+        "grades": grades,
+        "toxicity_rates": toxicity_rates(grades),
+    }
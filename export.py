@@ -0,0 +1,299 @@
+import argparse
+import collections
+import csv
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import openpyxl
+import pandas as pd
+
+from registry_schema import CATEGORIES, DATE_COLUMNS, LIST_COLUMNS, NUMERIC_COLUMNS, REGISTRY_COLUMNS
+from storage import ServiceBackend, SQLiteBackend, open_backend
+
+# What to export. columns: None for every registry column; filters: column ->
+# accepted values (any overlap for list columns); follow_up_from/to: ISO dates;
+# deidentify: hash MRNs, shift each patient's dates by up to max_shift_days,
+# reduce birth dates to the year and top-code ages over 89; key: secret for the MRN hashes and shifts (a random one
+# per export when None, so extracts cannot be linked to each other)
+ExportSpec = namedtuple(
+    "ExportSpec",
+    ["columns", "filters", "follow_up_from", "follow_up_to", "deidentify", "max_shift_days", "key"],
+    defaults=(None, None, None, None, True, 30, None),
+)
+
+# Columns whose meaning is known; exports that de-identify never include
+# anything else, since columns added by hand may hold identifiers
+KNOWN_COLUMNS = list(dict.fromkeys([*REGISTRY_COLUMNS, *NUMERIC_COLUMNS, *CATEGORIES]))
+
+# Where the web app keeps finished exports, and for how long
+export_directory = os.path.join(tempfile.gettempdir(), "registry-exports")
+export_retention_hours = 24
+
+
+def _list_pattern(values):
+    return "|".join(re.escape(repr(str(value))) for value in values)
+
+# Rows matching the spec's filters; chunk is in the stored (flat) format
+def filter_chunk(chunk, spec):
+    keep = pd.Series(True, index=chunk.index)
+    for column, values in (spec.filters or {}).items():
+        if not values:
+            continue
+        if column not in chunk:
+            return chunk.iloc[:0]
+        cells = chunk[column].astype(object).where(chunk[column].notna(), "").astype(str)
+        if column in LIST_COLUMNS:
+            keep &= cells.str.contains(_list_pattern(values), regex=True)
+        else:
+            keep &= cells.isin([str(value) for value in values])
+    if spec.follow_up_from or spec.follow_up_to:
+        if "Follow_up_date" not in chunk:
+            return chunk.iloc[:0]
+        follow_up = pd.to_datetime(chunk["Follow_up_date"], errors="coerce", format="%Y-%m-%d")
+        if spec.follow_up_from:
+            keep &= follow_up >= pd.Timestamp(spec.follow_up_from)
+        if spec.follow_up_to:
+            keep &= follow_up <= pd.Timestamp(spec.follow_up_to)
+    return chunk[keep]
+
+# Pseudonymous id and date shift (days) for each MRN, both keyed by the export secret
+def _pseudonyms(mrns, key, max_shift_days):
+    digests = [hmac.new(key, str(mrn).encode(), hashlib.sha256).digest() for mrn in mrns]
+    ids = [digest[:8].hex() for digest in digests]
+    shifts = [int.from_bytes(digest[8:12], "big") % (2 * max_shift_days + 1) - max_shift_days for digest in digests]
+    return ids, shifts
+
+def deidentify_chunk(chunk, key, max_shift_days=30):
+    chunk = chunk.copy()
+    codes, mrns = pd.factorize(chunk["MRN"].astype(str))
+    ids, shifts = _pseudonyms(mrns, key, max_shift_days)
+    shift = pd.to_timedelta(pd.Series(shifts, dtype="int64").to_numpy()[codes], unit="D")
+    chunk["MRN"] = pd.Series(ids, dtype=object).to_numpy()[codes]
+    # A birth date shifted by a few days still identifies the oldest patients,
+    # so only the year is kept, and patients over 89 today are all "90+"
+    if "Date_of_Birth" in chunk:
+        birth = pd.to_datetime(chunk["Date_of_Birth"], errors="coerce", format="%Y-%m-%d")
+        over_89 = birth <= pd.Timestamp.today().normalize() - pd.DateOffset(years=90)
+        year = birth.dt.year.astype("Int64").astype(object).where(birth.notna(), None)
+        chunk["Date_of_Birth"] = year.where(~over_89, "90+")
+    for column in DATE_COLUMNS:
+        if column in chunk and column != "Date_of_Birth":
+            # Cells that are not ISO dates cannot be shifted, so they are dropped
+            shifted = pd.to_datetime(chunk[column], errors="coerce", format="%Y-%m-%d") + shift
+            chunk[column] = shifted.dt.strftime("%Y-%m-%d").where(shifted.notna(), None)
+    if "Age" in chunk:
+        age = pd.to_numeric(chunk["Age"], errors="coerce")
+        chunk["Age"] = chunk["Age"].astype(object).where(~(age > 89), "90+")
+    return chunk
+
+
+# Streaming writers: rows go to disk chunk by chunk
+class CSVWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(columns)
+
+    def write(self, df):
+        df.to_csv(self._file, header=False, index=False)
+
+    def close(self):
+        self._file.close()
+
+class ExcelWriter:
+    def __init__(self, path, columns):
+        self.path = path
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Registry")
+        self._sheet.append(columns)
+
+    def write(self, df):
+        for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+            self._sheet.append(row)
+
+    def close(self):
+        self._workbook.save(self.path)
+
+def open_writer(path, columns):
+    return ExcelWriter(path, columns) if path.lower().endswith(".xlsx") else CSVWriter(path, columns)
+
+
+# Stream the registry (up to row `until`) through filters and de-identification
+# into path (.xlsx or .csv). progress(rows_read) is called after every chunk.
+# Returns the number of rows written.
+def write_export(backend, spec, path, until=None, chunk_size=10_000, progress=None):
+    available = backend.columns() if hasattr(backend, "columns") else REGISTRY_COLUMNS
+    columns = list(spec.columns or [column for column in KNOWN_COLUMNS if column in available]
+                   + [column for column in available if column not in KNOWN_COLUMNS])
+    if spec.deidentify:
+        columns = [column for column in columns if column in KNOWN_COLUMNS]
+    key = spec.key or secrets.token_bytes(32)
+    writer = open_writer(path, columns)
+    read = written = 0
+    try:
+        for chunk in backend.iter_chunks(chunk_size, until):
+            read += len(chunk)
+            chunk = filter_chunk(chunk, spec)
+            if spec.deidentify and len(chunk):
+                chunk = deidentify_chunk(chunk, key, spec.max_shift_days)
+            writer.write(chunk.reindex(columns=columns))
+            written += len(chunk)
+            if progress:
+                progress(read)
+    finally:
+        writer.close()
+    return written
+
+
+def spec_to_json(spec):
+    return json.dumps({**spec._asdict(), "key": spec.key.hex() if spec.key else None})
+
+def spec_from_json(text):
+    fields = json.loads(text)
+    fields["key"] = bytes.fromhex(fields["key"]) if fields.get("key") else None
+    return ExportSpec(**fields)
+
+
+# One export request; rows_read, status and result are read by the UI
+class ExportJob:
+    def __init__(self, job_id, spec, path, total):
+        self.id = job_id
+        self.spec = spec
+        self.path = path
+        self.total = total
+        self.rows_read = 0
+        self.created = time.time()
+        self._future = None
+
+    @property
+    def status(self):
+        if not self._future.done():
+            return "running" if self.rows_read else "queued"
+        return "failed" if self._future.exception() else "done"
+
+    # Rows written; raises if the export failed
+    def result(self):
+        return self._future.result()
+
+    @property
+    def error(self):
+        return self._future.exception() if self._future.done() else None
+
+
+# Runs each export in its own worker process (this script with --job), at
+# most max_workers at a time, so a large extract neither blocks the Streamlit
+# server nor competes with data entry for the GIL. Workers read the storage
+# themselves; SQLite in WAL mode lets them read while saves go on. (A
+# multiprocessing pool cannot be used here: under Streamlit, __main__ is the
+# page script, which spawned workers would re-run.)
+class ExportManager:
+    def __init__(self, directory=None, max_workers=2):
+        self.directory = directory or export_directory
+        os.makedirs(self.directory, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="registry-export")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    # Queue an export of backend as it is now; fmt is "xlsx" or "csv"
+    def submit(self, backend, spec, fmt="xlsx"):
+        self._remove_expired()
+        job_id = uuid.uuid4().hex[:12]
+        job = ExportJob(job_id, spec, os.path.join(self.directory, f"registry_export_{job_id}.{fmt}"), len(backend))
+        # Rows saved while the export runs are left out, so it is a consistent snapshot
+        until = backend.signature() if isinstance(backend, (SQLiteBackend, ServiceBackend)) else None
+        # Only row ids can pin an export to the moment it was started
+        until = until if isinstance(until, int) else None
+        job._future = self._pool.submit(self._run, job, backend.name, backend.path, until)
+        with self._lock:
+            self._jobs[job_id] = job
+        return job
+
+    def _run(self, job, backend_name, backend_path, until):
+        command = [sys.executable, os.path.abspath(__file__), job.path, "--job", "--backend", backend_name, "--database", backend_path]
+        if until is not None:
+            command += ["--until", str(until)]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        process.stdin.write(spec_to_json(job.spec))
+        process.stdin.close()
+        written, output = None, collections.deque(maxlen=20)
+        for line in process.stdout:
+            kind, _, value = line.strip().partition(" ")
+            if kind == "@read":
+                job.rows_read = int(value)
+            elif kind == "@written":
+                written = int(value)
+            else:
+                output.append(line.rstrip())
+        if process.wait() != 0 or written is None:
+            raise RuntimeError(output[-1] if output else f"export worker exited with status {process.returncode}")
+        return written
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _remove_expired(self):
+        cutoff = time.time() - export_retention_hours * 3600
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.created < cutoff and job.status in ("done", "failed")]
+            for job in expired:
+                del self._jobs[job.id]
+                if os.path.exists(job.path):
+                    os.remove(job.path)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a filtered, optionally de-identified extract of the registry.")
+    parser.add_argument("output", help=".xlsx or .csv file")
+    parser.add_argument("--database", default="registry.db", help="registry database (workbook with --backend excel, URL with --backend service)")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "excel", "service"])
+    parser.add_argument("--columns", help="comma-separated columns (default: all registry columns)")
+    parser.add_argument("--filter", action="append", default=[], metavar="COLUMN=V1,V2", help="keep rows with one of these values")
+    parser.add_argument("--from", dest="follow_up_from", help="first follow-up date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="follow_up_to", help="last follow-up date (YYYY-MM-DD)")
+    parser.add_argument("--identified", action="store_true", help="keep MRNs, dates and ages as stored")
+    parser.add_argument("--max-shift-days", type=int, default=30)
+    parser.add_argument("--until", type=int, help="last row id to export")
+    parser.add_argument("--job", action="store_true", help="worker mode: read the spec as JSON from stdin, report @read/@written lines")
+    args = parser.parse_args()
+
+    if args.job:
+        spec = spec_from_json(sys.stdin.read())
+    else:
+        filters = {}
+        for item in args.filter:
+            column, _, values = item.partition("=")
+            filters[column] = [value.strip() for value in values.split(",") if value.strip()]
+        spec = ExportSpec(
+            columns=args.columns.split(",") if args.columns else None,
+            filters=filters,
+            follow_up_from=args.follow_up_from,
+            follow_up_to=args.follow_up_to,
+            deidentify=not args.identified,
+            max_shift_days=args.max_shift_days,
+        )
+    backend = open_backend(args.backend, args.database, args.database)
+    if args.job:
+        written = write_export(backend, spec, args.output, args.until, progress=lambda read: print(f"@read {read}", flush=True))
+        print(f"@written {written}", flush=True)
+    else:
+        total = len(backend)
+        written = write_export(backend, spec, args.output, args.until,
+            progress=lambda read: print(f"\r{read} of {total} rows read", end="", flush=True))
+        print()
+        print(f"wrote {written} rows to {args.output}")
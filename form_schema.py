@@ -0,0 +1,295 @@
+# Declarative description of the visit form. One entry per field drives how
+# the app renders it, how it is prefilled from a stored visit, how it is
+# validated and which column it is saved to.
+import calendar
+from collections import namedtuple
+from datetime import date
+
+from registry import calculate_months, safe_get, safe_get_date, safe_get_list
+from registry_schema import CATEGORIES, LIST_OPTIONS
+
+# key: storage column (and widget name); kind: "text", "date", "radio" or "multiselect";
+# stored: False for inputs that only feed a calculated column; descriptions: lines of
+# the classification expander; show_if: (key, value) of the field that reveals this one;
+# note: warning shown under the field; past: date that cannot be in the future
+Field = namedtuple(
+    "Field",
+    ["key", "label", "kind", "options", "stored", "descriptions", "show_if", "note", "past"],
+    defaults=(None, True, (), None, None, False),
+)
+
+# A group of fields rendered (and rerun) together
+Section = namedtuple("Section", ["title", "fields", "divider"], defaults=(False,))
+
+# Placeholder for stored visits that have no date in a date column
+MISSING_DATE = date(1900, 1, 1)
+
+GRADE_V = "Grade V: Death"
+GRADE_IV = "Grade IV: Life-threatening consequences; urgent intervention indicated"
+
+CLINICAL_STAGE_DESCRIPTIONS = [
+    "cT0: No evidence of primary tumor",
+    "cTx: Primary tumor cannot be assessed",
+    "cT1a: Tumor ≤4 cm in greatest dimension, limited to the kidney",
+    "cT1b: Tumor >4 cm but ≤7 cm in greatest dimension, limited to the kidney",
+    "cT2a: Tumor confined to kidney, >7 cm but not >10 cm",
+    "cT2b: Tumor confined to kidney, >10 cm",
+    "cT3a: Tumor grossly extends into the renal vein or its segmental (muscle-containing) branches, invades the pelvicalyceal system, or invades perirenal and/or renal sinus fat but not beyond the Gerota fascia",
+    "cT3b: Tumor extends into the vena cava above the diaphragm or invades the wall of the vena cava",
+    "cT3c: Tumor extends into the vena cava wall with extension into the vena cava wall",
+    "cT4: Tumor invades beyond Gerota's fascia",
+]
+
+PERFORATION_DESCRIPTIONS = [
+    "Absent: No change",
+    "Grade II: Invasive intervention not indicated ",
+    "Grade III: Symptomatic; medical intervention indicated",
+    GRADE_IV,
+    GRADE_V,
+]
+
+CTCAE_DESCRIPTIONS = {
+    "Cystitis": [
+        "Grade 0: No change",
+        "Grade I: Microscopic hematuria; minimal increase in frequency, urgency, dysuria, or nocturia; new onset of incontinence ",
+        "Grade II: Moderate hematuria; moderate increase in frequency, urgency, dysuria, nocturia or incontinence; urinary catheter placement or bladder irrigation indicated; limiting instrumental ADL ",
+        "Grade III: Gross hematuria; transfusion, IV medications, or hospitalization indicated; elective invasive intervention indicated ",
+        "Grade IV: Life-threatening consequences; urgent invasive intervention indicated ",
+        GRADE_V,
+    ],
+    "Bladder_Perforation": PERFORATION_DESCRIPTIONS,
+    "Hematuria": [
+        "Absent: No change",
+        "Grade I: Asymptomatic; clinical or diagnostic observations only; intervention not indicated",
+        "Grade II: Symptomatic; urinary catheter or bladder irrigation indicated; limiting instrumental ADL",
+        "Grade III: Gross hematuria; transfusion, IV medications, or hospitalization indicated; elective invasive intervention indicated; limiting self care ADL",
+        "Grade IV: Life-threatening consequences; urgent invasive intervention indicated",
+        GRADE_V,
+    ],
+    "Urinary_Fistula": PERFORATION_DESCRIPTIONS,
+    "Urinary_Obstruction": [
+        "Absent: No change",
+        "Grade I: Asymptomatic; clinical or diagnostic observations only; intervention not indicated",
+        "Grade II: Symptomatic but no hydronephrosis, sepsis, or renal dysfunction; urethral dilation, urinary or suprapubic catheter indicated",
+        "Grade III: Altered organ function (e.g., hydronephrosis or renal dysfunction); invasive intervention indicated",
+        GRADE_IV,
+        GRADE_V,
+    ],
+    "Diarrhea": [
+        "Absent: No change",
+        "Grade I: Increase of <4 stools/day over baseline; mild increase in ostomy output compared to baseline",
+        "Grade II: Increase of 4-6 stools/day over baseline; moderate increase in ostomy output compared to baseline; limiting instrumental ADL",
+        "Grade III: Increase of ≥7 stools/day over baseline; incontinence; limiting self care ADL",
+        GRADE_IV,
+        GRADE_V,
+    ],
+    "Nausea": [
+        "Absent: No change",
+        "Grade I: Loss of appetite without alteration in eating habits",
+        "Grade II: Oral intake decreased without significant weight loss, dehydration, or malnutrition; IV fluids indicated <24 hrs",
+        "Grade III: Inadequate oral caloric or fluid intake; tube feeding or TPN indicated",
+        GRADE_IV,
+        GRADE_V,
+    ],
+    "Bowel_Perforation": PERFORATION_DESCRIPTIONS,
+    "Bowel_Obstruction": [
+        "Absent: No change",
+        "Grade I: Asymptomatic; clinical or diagnostic observations only; intervention not indicated",
+        "Grade II: Symptomatic; noninvasive intervention indicated",
+        "Grade III: Symptomatic; invasive intervention indicated",
+        GRADE_IV,
+        GRADE_V,
+    ],
+    "Fatigue": [
+        "Grade 0: No fatigue",
+        "Grade I: Mild fatigue; no change in activity",
+        "Grade II: Moderate fatigue; limiting instrumental ADL",
+        "Grade III: Severe fatigue; limiting self care ADL",
+    ],
+}
+
+
+def _radio(key, label, **kwargs):
+    return Field(key, label, "radio", CATEGORIES[key], **kwargs)
+
+def _multiselect(key, label, **kwargs):
+    return Field(key, label, "multiselect", LIST_OPTIONS[key], **kwargs)
+
+def _toxicity(key, label):
+    return _radio(key, label, descriptions=CTCAE_DESCRIPTIONS[key])
+
+
+SECTIONS = [
+    Section("Patient Details", [
+        Field("Date_of_Birth", "Date of Birth", "date", past=True),
+        Field("MRN", "MRN (Medical Record Number)", "text"),
+        Field("Date_of_Last_Radiotherapy", "Date of Last Radiotherapy", "date"),
+        Field("Follow_up_date", "Date of Follow-up", "date"),
+    ]),
+    Section("Tumor and Staging", [
+        _multiselect("Histology", "Histology", note="Not sure about histological classification? Click [here](https://www.pathologyoutlines.com/topic/kidneytumorWHOclass.html) to use Pathology Outlines."),
+        _radio("Grade", "Grade"),
+        _radio("Tumor_Focality", "Tumor_Focality"),
+        _multiselect("Clinical_Stage", "Clinical Stage", descriptions=CLINICAL_STAGE_DESCRIPTIONS),
+        _radio("Type_of_Confirmatory_procedure", "Type of Confirmatory procedure"),
+        Field("Biopsy_date", "Date of Biopsy", "date"),
+        _radio("Recurrent_Tumor", "Recurrent Tumor"),
+        Field("Recurrence_date", "Date of Recurrence", "date", show_if=("Recurrent_Tumor", "Yes")),
+        _radio("Surgery_type", "Surgery type", show_if=("Recurrent_Tumor", "Yes")),
+        Field("Surgery_date", "Date of Surgery", "date", show_if=("Recurrent_Tumor", "Yes")),
+    ]),
+    Section("Systemic Treatment", [
+        _multiselect("Systemic_Treatment", "Systemic_Treatment"),
+        Field("Systemic_Treatment_first_date", "First Date of Systemic_Treatment", "date"),
+        Field("Systemic_Treatment_last_date", "Last Date of Systemic_Treatment", "date"),
+    ]),
+    Section("Treatment Details", [
+        _multiselect("Dose", "Dose"),
+        _multiselect("Fractionation", "Fractionation"),
+    ]),
+    Section("Urinary Side Effects", [
+        _radio("Dysuria", "Dysuria (CTCAE v5)"),
+        _toxicity("Cystitis", "Cystitis (CTCAE v5)"),
+        _toxicity("Bladder_Perforation", "Bladder Perforation (CTCAE v5)"),
+        _toxicity("Hematuria", "Hematuria (CTCAE v5)"),
+        _toxicity("Urinary_Fistula", "Urinary Fistula (CTCAE v5)"),
+        _toxicity("Urinary_Obstruction", "Urinary Obstruction (CTCAE v5)"),
+        _radio("Ureteral_Stenosis", "Ureteral Stenosis"),
+        Field("Ureteral_Stenosis_date", "Date of Ureteral Stenosis", "date", stored=False, show_if=("Ureteral_Stenosis", "Present")),
+    ], divider=True),
+    Section("Gastrointestinal Side Effects", [
+        _toxicity("Diarrhea", "Diarrhea (CTCAE v5)"),
+        _toxicity("Nausea", "Nausea (CTCAE v5)"),
+        _toxicity("Bowel_Perforation", "Bowel Perforation (CTCAE v5)"),
+        _toxicity("Bowel_Obstruction", "Bowel Obstruction (CTCAE v5)"),
+    ]),
+    Section("Fatigue", [
+        _toxicity("Fatigue", "Fatigue"),
+        _radio("Overal_tolerance", "Overall Tolerance"),
+    ]),
+    Section("Recurrence Details", [
+        _radio("Local_recurrence", "Local Recurrence"),
+        _radio("Regional_recurrence", "Regional Recurrence"),
+        _radio("Distant_recurrence", "Distant Recurrence"),
+        _radio("Death", "Death"),
+        Field("Local_recurrence_date", "Date of Local Recurrence", "date", stored=False, show_if=("Local_recurrence", "Yes")),
+        Field("Regional_recurrence_date", "Date of Regional Recurrence", "date", stored=False, show_if=("Regional_recurrence", "Yes")),
+        Field("Distant_recurrence_date", "Date of Distant Recurrence", "date", stored=False, show_if=("Distant_recurrence", "Yes")),
+        _radio("Cancer Related Death", "Cancer Related Death", show_if=("Death", "Yes")),
+        Field("Death_date", "Date of Death", "date", stored=False, show_if=("Death", "Yes")),
+    ]),
+]
+
+FIELDS = [field for section in SECTIONS for field in section.fields]
+
+# Event flag -> (saved months column, date field it is counted to from the last radiotherapy)
+EVENT_TIMES = {
+    "Local_recurrence": ("Time_to_local_recurrence", "Local_recurrence_date"),
+    "Regional_recurrence": ("Time_to_regional_recurrence", "Regional_recurrence_date"),
+    "Distant_recurrence": ("Time_to_distant_recurrence", "Distant_recurrence_date"),
+    "Death": ("time_to_death", "Death_date"),
+}
+# Event date field -> saved months column
+EVENT_DATES = {date_key: column for column, date_key in EVENT_TIMES.values()}
+
+
+def is_visible(field, values):
+    return field.show_if is None or values.get(field.show_if[0]) == field.show_if[1]
+
+# Event dates are not stored, only the months from the last radiotherapy to
+# them; a follow-up rebuilds a date that many months on, so saving it again
+# keeps the stored months unless the user changes the date
+def _event_date(patient_data, field, today):
+    column = EVENT_DATES[field.key]
+    months = safe_get(patient_data, column, None)
+    months = safe_get(patient_data, column.lower(), None) if months is None else months
+    radiotherapy_date = safe_get_date(patient_data, "Date_of_Last_Radiotherapy", None)
+    try:
+        months = int(float(months))
+    except (TypeError, ValueError):
+        return today
+    if radiotherapy_date is None:
+        return today
+    year, month = divmod(radiotherapy_date.year * 12 + radiotherapy_date.month - 1 + months, 12)
+    return date(year, month + 1, min(radiotherapy_date.day, calendar.monthrange(year, month + 1)[1]))
+
+# Value of a field for a new visit, or prefilled from a stored one
+def prefill_value(field, patient_data=None, today=None):
+    today = today or date.today()
+    if field.kind == "date" and patient_data and field.key in EVENT_DATES:
+        return _event_date(patient_data, field, today)
+    if field.kind == "date":
+        return safe_get_date(patient_data, field.key, MISSING_DATE) if patient_data and field.stored else today
+    if field.kind == "text":
+        return str(safe_get(patient_data, field.key, "")) if patient_data else ""
+    if field.kind == "radio":
+        value = safe_get(patient_data, field.key, field.options[0]) if patient_data else field.options[0]
+        return value if value in field.options else field.options[0]
+    return [value for value in safe_get_list(patient_data, field.key) if value in field.options] if patient_data else []
+
+def prefill_values(patient_data=None, today=None):
+    return {field.key: prefill_value(field, patient_data, today) for field in FIELDS}
+
+
+# Age, follow-up and months to each reported event, as the form saves them
+def calculated_values(values, today=None):
+    today = today or date.today()
+    birth_date = values["Date_of_Birth"]
+    radiotherapy_date = values["Date_of_Last_Radiotherapy"]
+    calculated = {
+        "Age": today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day)),
+        "Follow_up_time": calculate_months(radiotherapy_date, values["Follow_up_date"]),
+    }
+    for flag, (column, date_key) in EVENT_TIMES.items():
+        calculated[column] = calculate_months(radiotherapy_date, values[date_key]) if values.get(flag) == "Yes" else "N/A"
+    return calculated
+
+# Problems that stop a visit from being saved, as messages for the user
+def validate(values):
+    errors = []
+    if not str(values.get("MRN") or "").strip():
+        errors.append("MRN is required.")
+    for field in FIELDS:
+        if not is_visible(field, values):
+            continue
+        value = values.get(field.key)
+        if field.kind == "date" and not isinstance(value, date):
+            errors.append(f"{field.label}: enter a date.")
+        elif field.kind == "radio" and value not in field.options:
+            errors.append(f"{field.label}: choose one of the options.")
+        elif field.kind == "multiselect" and not set(value or []) <= set(field.options):
+            errors.append(f"{field.label}: choose from the options.")
+    if errors:
+        return errors
+
+    radiotherapy_date = values["Date_of_Last_Radiotherapy"]
+    if values["Date_of_Birth"] > radiotherapy_date:
+        errors.append("Date of Birth is after the Date of Last Radiotherapy.")
+    if values["Follow_up_date"] < radiotherapy_date:
+        errors.append("Date of Follow-up is before the Date of Last Radiotherapy.")
+    for flag, (_, date_key) in EVENT_TIMES.items():
+        if values.get(flag) != "Yes":
+            continue
+        label = next(field.label for field in FIELDS if field.key == date_key)
+        if values[date_key] < radiotherapy_date:
+            errors.append(f"{label} is before the Date of Last Radiotherapy.")
+        elif values[date_key] > values["Follow_up_date"]:
+            errors.append(f"{label} is after the Date of Follow-up.")
+    return errors
+
+# The row handed to save_data: every stored field (hidden ones as "N/A") plus the calculated columns
+def to_record(values, today=None):
+    record = {}
+    for field in FIELDS:
+        if not field.stored:
+            continue
+        value = values.get(field.key)
+        if not is_visible(field, values):
+            value = "N/A"
+        elif field.kind == "date":
+            value = value.strftime("%Y-%m-%d")
+        elif field.kind == "text":
+            value = value.strip()
+        record[field.key] = value
+    record.update(calculated_values(values, today))
+    return record
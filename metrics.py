@@ -0,0 +1,277 @@
+import argparse
+import collections
+import cProfile
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Timings kept for percentiles; the oldest are dropped first
+buffer_size = 20_000
+# Write the metrics to this file every metrics_interval seconds ("" disables it);
+# .json files get JSON, anything else Prometheus text (e.g. for a textfile collector)
+metrics_file = os.environ.get("REGISTRY_METRICS_FILE", "")
+metrics_interval = 15
+# Serve /metrics (Prometheus text) and /metrics.json on this local port (0 disables it)
+metrics_port = int(os.environ.get("REGISTRY_METRICS_PORT", "0"))
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+log = logging.getLogger("registry.metrics")
+
+# One timed call: when it finished (Unix time), what it was and how long it took (seconds)
+Sample = collections.namedtuple("Sample", ["time", "name", "seconds"])
+
+
+# Always-on timings, counters and gauges of the hot paths, for this process.
+# Recording a timing is a deque append under a lock; percentiles are only
+# computed when somebody looks. Gauges are callables read at that point too.
+class Metrics:
+    def __init__(self, size=None):
+        self.started = time.time()
+        self._samples = collections.deque(maxlen=size or buffer_size)
+        self._counters = collections.Counter()
+        self._totals = collections.Counter()
+        self._sums = collections.Counter()
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._samples.append(Sample(time.time(), name, seconds))
+            self._totals[name] += 1
+            self._sums[name] += seconds
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    # read() is called whenever the metrics are reported
+    def gauge(self, name, read):
+        with self._lock:
+            self._gauges[name] = read
+
+    def samples(self, name=None):
+        with self._lock:
+            samples = list(self._samples)
+        return [sample for sample in samples if name is None or sample.name == name]
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def gauges(self):
+        with self._lock:
+            gauges = dict(self._gauges)
+        values = {}
+        for name, read in gauges.items():
+            try:
+                values[name] = read()
+            except Exception:
+                values[name] = None
+        return values
+
+    # Percentiles (seconds) of every timing still in the buffer; count and sum
+    # cover every call since start, the rest only the buffered ones
+    def summary(self):
+        by_name = collections.defaultdict(list)
+        for sample in self.samples():
+            by_name[sample.name].append(sample.seconds)
+        with self._lock:
+            totals = dict(self._totals)
+            sums = dict(self._sums)
+        summary = {}
+        for name in sorted(by_name):
+            values = np.array(by_name[name])
+            summary[name] = {
+                "count": totals.get(name, len(values)),
+                "sum": sums.get(name, float(values.sum())),
+                "buffered": len(values),
+                "mean": float(values.mean()),
+                "max": float(values.max()),
+                **{f"p{round(q * 100)}": float(np.quantile(values, q)) for q in QUANTILES},
+            }
+        return summary
+
+    # Hits over all lookups of a hits/misses counter pair, None before the first lookup
+    def ratio(self, hits, *misses):
+        counters = self.counters()
+        total = counters.get(hits, 0) + sum(counters.get(name, 0) for name in misses)
+        return counters.get(hits, 0) / total if total else None
+
+    def to_json(self):
+        return json.dumps({
+            "started": self.started,
+            "timings": self.summary(),
+            "counters": self.counters(),
+            "gauges": self.gauges(),
+        }, indent=2)
+
+    # Prometheus text exposition format: timings as summaries, counters and gauges as such
+    def to_prometheus(self, prefix="registry"):
+        lines = []
+        for name, stats in self.summary().items():
+            metric = _metric_name(prefix, name, "seconds")
+            lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                lines.append(f'{metric}{{quantile="{q}"}} {stats[f"p{round(q * 100)}"]:.6f}')
+            lines.append(f"{metric}_sum {stats['sum']:.6f}")
+            lines.append(f"{metric}_count {stats['count']}")
+        for name, value in sorted(self.counters().items()):
+            metric = _metric_name(prefix, name, "total")
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in sorted(self.gauges().items()):
+            if value is None:
+                continue
+            metric = _metric_name(prefix, name)
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        text = self.to_json() if path.lower().endswith(".json") else self.to_prometheus()
+        # Replace the file in one step, so a scraper never reads half of it
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+# Splits one script run into consecutive phases: mark(phase) records the time
+# since the previous mark as <prefix>.<phase>, finish() the whole run as <prefix>.total
+class PhaseTimer:
+    def __init__(self, metrics, prefix="rerun"):
+        self.metrics = metrics
+        self.prefix = prefix
+        self.started = self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.metrics.observe(f"{self.prefix}.{phase}", now - self._last)
+        self._last = now
+
+    def finish(self):
+        self.metrics.observe(f"{self.prefix}.total", time.perf_counter() - self.started)
+
+
+def _metric_name(prefix, name, unit=None):
+    name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{name}")
+    return f"{name}_{unit}" if unit else name
+
+
+# The metrics of this process
+_metrics = Metrics()
+
+def get_metrics():
+    return _metrics
+
+
+# cProfile capture of a single rerun: start_profile() returns a profiler when
+# a capture is wanted and none is running, finish_profile() keeps its report
+# for the metrics page. Only the calling thread is profiled.
+_profile_lock = threading.Lock()
+last_profile = None
+
+Profile = collections.namedtuple("Profile", ["time", "label", "seconds", "report", "data"])
+
+def start_profile():
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    profiler.started = time.perf_counter()
+    return profiler
+
+def finish_profile(profiler, label, limit=40):
+    global last_profile
+    try:
+        profiler.disable()
+        seconds = time.perf_counter() - profiler.started
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats("cumulative").print_stats(limit)
+        # Same bytes as stats.dump_stats() writes, for download as a .prof file
+        last_profile = Profile(time.time(), label, seconds, report.getvalue(), marshal.dumps(stats.stats))
+    finally:
+        _profile_lock.release()
+    return last_profile
+
+
+# Local exporters, started once per process
+_file_exporter = None
+_port_exporter = None
+_exporters_lock = threading.Lock()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = get_metrics().to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = get_metrics().to_json(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _write_periodically(path, interval):
+    while True:
+        try:
+            get_metrics().write(path)
+        except OSError:
+            pass
+        time.sleep(interval)
+
+# A port already taken (say by another replica on the same host) is logged
+# rather than raised, so the app still starts; a later call tries again
+def start_exporters(path=None, port=None):
+    global _file_exporter, _port_exporter
+    path = metrics_file if path is None else path
+    port = metrics_port if port is None else port
+    with _exporters_lock:
+        if path and _file_exporter is None:
+            _file_exporter = threading.Thread(target=_write_periodically, args=(path, metrics_interval), name="metrics-file", daemon=True)
+            _file_exporter.start()
+        if port and _port_exporter is None:
+            try:
+                server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+            except OSError as error:
+                log.warning("metrics are not served on port %d: %s", port, error)
+                return
+            _port_exporter = server
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the metrics served by a running registry app.")
+    parser.add_argument("--port", type=int, default=metrics_port or 9464)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    from urllib.request import urlopen
+
+    with urlopen(f"http://127.0.0.1:{args.port}/metrics{'.json' if args.json else ''}") as response:
+        print(response.read().decode())
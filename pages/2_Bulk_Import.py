@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+import streamlit as st
+
+from bulk_import import import_file
+import registry
+
+st.title("Bulk Import")
+st.write("Load historical visits from an Excel workbook or CSV file. Columns are matched to the registry by name, "
+         "and rows that fail validation are skipped and listed in an error report.")
+st.caption("Very large files are better imported from the command line: `python bulk_import.py data.xlsx`")
+
+# The workbook backend rewrites the whole file on every commit, once per chunk
+if registry.storage_backend == "excel":
+    st.error("Bulk import needs the database backend. Migrate the workbook first: "
+             "`python storage.py migrate registry.xlsx`, then run the app without REGISTRY_BACKEND=excel.")
+    st.stop()
+
+uploaded = st.file_uploader("Spreadsheet", type=["xlsx", "csv"])
+dayfirst = st.checkbox("Dates are written day first (DD/MM/YYYY)")
+
+if uploaded is not None and st.button("Import"):
+    suffix = os.path.splitext(uploaded.name)[1]
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "upload" + suffix)
+        errors_file = os.path.join(directory, "errors.csv")
+        with open(source, "wb") as f:
+            f.write(uploaded.getbuffer())
+
+        status = st.empty()
+        summary = import_file(
+            source,
+            # Chunks go through the app's writer, queued with the clinics' saves
+            registry.get_registry_store().append_rows,
+            errors_file=errors_file,
+            dayfirst=dayfirst,
+            progress=lambda done: status.write(f"{done} rows read..."),
+        )
+        status.empty()
+
+        st.success(f"Imported {summary.imported} of {summary.rows} rows.")
+        if summary.unmapped_columns:
+            st.warning("Ignored columns with no registry match: " + ", ".join(map(str, summary.unmapped_columns)))
+        if summary.rejected:
+            st.error(f"{summary.rejected} rows were rejected.")
+            with open(errors_file, "rb") as f:
+                st.download_button("Download error report", f.read(), file_name="import_errors.csv", mime="text/csv")
@@ -0,0 +1,79 @@
+import os
+from datetime import date
+
+import streamlit as st
+
+from export import ExportManager, ExportSpec
+from registry import get_backend
+from registry_schema import CATEGORIES, DOSE_OPTIONS, HISTOLOGY_OPTIONS, REGISTRY_COLUMNS
+
+
+# Worker processes shared by every session of this server
+@st.cache_resource
+def get_export_manager():
+    return ExportManager()
+
+
+st.title("Research Export")
+st.write("Build a filtered extract of the registry. Exports run in the background, so data entry is not "
+         "held up; leave this page open to follow progress and download the file when it is ready.")
+
+with st.form("export_form"):
+    columns = st.multiselect("Columns", REGISTRY_COLUMNS, default=REGISTRY_COLUMNS)
+    histology = st.multiselect("Histology", HISTOLOGY_OPTIONS, help="Leave empty to include every histology")
+    dose = st.multiselect("Dose", DOSE_OPTIONS, help="Leave empty to include every dose")
+    grade = st.multiselect("Grade", CATEGORIES["Grade"], help="Leave empty to include every grade")
+    limit_dates = st.checkbox("Only follow-up visits between")
+    col1, col2 = st.columns(2)
+    follow_up_from = col1.date_input("From", value=date(2000, 1, 1), min_value=date(1900, 1, 1))
+    follow_up_to = col2.date_input("To", value=date.today(), min_value=date(1900, 1, 1))
+    deidentify = st.checkbox("De-identify", value=True,
+        help="Replace MRNs with pseudonyms, shift each patient's dates by a random number of days, "
+             "keep only the year of birth and report ages over 89 as 90+")
+    max_shift_days = st.slider("Maximum date shift (days)", 1, 365, 30)
+    file_format = st.radio("Format", ["xlsx", "csv"], horizontal=True)
+    submitted = st.form_submit_button("Start export")
+
+if submitted:
+    if not columns:
+        st.error("Choose at least one column.")
+    else:
+        spec = ExportSpec(
+            columns=columns,
+            filters={"Histology": histology, "Dose": dose, "Grade": grade},
+            follow_up_from=follow_up_from.isoformat() if limit_dates else None,
+            follow_up_to=follow_up_to.isoformat() if limit_dates else None,
+            deidentify=deidentify,
+            max_shift_days=max_shift_days,
+        )
+        job = get_export_manager().submit(get_backend(), spec, file_format)
+        st.session_state.setdefault("export_jobs", []).append(job.id)
+
+
+# Progress of the running jobs, polled without rerunning the rest of the page;
+# the page reruns once they have all finished to offer the downloads
+@st.fragment(run_every=2)
+def show_progress(job_ids):
+    jobs = [get_export_manager().get(job_id) for job_id in job_ids]
+    if all(job.status in ("done", "failed") for job in jobs):
+        st.rerun()
+    for job in jobs:
+        st.progress(min(job.rows_read / job.total, 1.0) if job.total else 0.0,
+            text=f"{os.path.basename(job.path)}: {job.rows_read} of {job.total} rows read")
+
+
+manager = get_export_manager()
+jobs = [job for job in map(manager.get, st.session_state.get("export_jobs", [])) if job is not None]
+if jobs:
+    st.subheader("Exports")
+running = [job.id for job in jobs if job.status in ("queued", "running")]
+if running:
+    show_progress(running)
+for job in reversed(jobs):
+    name = os.path.basename(job.path)
+    if job.status == "done":
+        st.write(f"**{name}**: {job.result()} rows")
+        with open(job.path, "rb") as f:
+            st.download_button("Download", f.read(), file_name=name, key=f"download_{job.id}")
+    elif job.status == "failed":
+        st.error(f"{name} failed: {job.error}")
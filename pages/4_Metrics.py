@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+import metrics
+from metrics import get_metrics
+from registry import get_registry_store
+
+st.title("Metrics")
+st.write("Timings and counters of this server process since it started. Timings are kept for the most recent "
+         f"{metrics.buffer_size:,} calls, so percentiles describe recent load.")
+
+get_registry_store()
+registry_metrics = get_metrics()
+gauges = registry_metrics.gauges()
+counters = registry_metrics.counters()
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Visits", f"{gauges.get('rows') or 0:,}")
+col2.metric("Storage size", f"{(gauges.get('storage_bytes') or 0) / 2**20:.1f} MB")
+hit_rate = registry_metrics.ratio("cache.hits", "cache.catch_ups", "cache.reloads")
+col3.metric("Cache hit rate", f"{hit_rate:.1%}" if hit_rate is not None else "N/A")
+col4.metric("Saves", f"{counters.get('saves', 0):,}")
+
+# Percentiles in milliseconds
+summary = registry_metrics.summary()
+if summary:
+    st.subheader("Timings (ms)")
+    table = pd.DataFrame(summary).T
+    milliseconds = [column for column in table if column not in ("count", "buffered")]
+    table[milliseconds] *= 1000
+    st.dataframe(table.style.format("{:.1f}", subset=milliseconds), use_container_width=True)
+
+    reruns = registry_metrics.samples("rerun.total")
+    if reruns:
+        st.subheader("Recent form reruns")
+        st.line_chart(pd.DataFrame({
+            "Time": [datetime.fromtimestamp(sample.time) for sample in reruns],
+            "Rerun (ms)": [sample.seconds * 1000 for sample in reruns],
+        }), x="Time", y="Rerun (ms)")
+else:
+    st.info("No timings yet: use the patient form and come back.")
+
+with st.expander("Counters and gauges"):
+    st.json({"counters": counters, "gauges": gauges})
+
+st.subheader("Export")
+col1, col2 = st.columns(2)
+col1.download_button("Prometheus text", registry_metrics.to_prometheus(), file_name="registry_metrics.prom", mime="text/plain")
+col2.download_button("JSON", registry_metrics.to_json(), file_name="registry_metrics.json", mime="application/json")
+if metrics.metrics_file:
+    st.caption(f"Also written to {metrics.metrics_file} every {metrics.metrics_interval} seconds.")
+if metrics.metrics_port:
+    st.caption(f"Also served at http://127.0.0.1:{metrics.metrics_port}/metrics and /metrics.json.")
+
+st.subheader("Profile a rerun")
+st.write("Capture a cProfile of the next run of the patient form in this browser session.")
+if st.button("Profile the next form rerun"):
+    st.session_state["profile_next_rerun"] = True
+if st.session_state.get("profile_next_rerun"):
+    st.info("Armed: open the patient form and use it; the next run is profiled.")
+profile = metrics.last_profile
+if profile is not None:
+    st.write(f"**{profile.label}**, {datetime.fromtimestamp(profile.time):%Y-%m-%d %H:%M:%S}: {profile.seconds * 1000:.0f} ms")
+    st.code(profile.report, language=None)
+    st.download_button("Download .prof", profile.data, file_name="rerun.prof",
+        help="Open with snakeviz, or pstats.Stats(\"rerun.prof\")")
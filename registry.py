@@ -0,0 +1,405 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from metrics import get_metrics, start_exporters
+from mrn_search import MRNSearchIndex
+from snapshot import RAW_SUFFIX, concat_typed, read_snapshot, same_signature, to_typed, to_typed_record, write_snapshot
+from storage import migrate_from_excel, open_backend, to_cell
+from visit_index import VisitIndex
+from writer import GroupCommitWriter
+
+# File path for local storage
+database_file = os.environ.get("REGISTRY_DB", "registry.db")
+# Workbook used by the "excel" backend; with the database backends an existing
+# workbook here is migrated into the database on first start
+excel_file = os.environ.get("REGISTRY_EXCEL", "registry.xlsx")
+# Typed Parquet snapshot of the registry, memory-mapped on cold start ("" disables it)
+snapshot_file = os.environ.get("REGISTRY_SNAPSHOT", "registry.parquet")
+# Rewrite the snapshot once this many rows have been written since it was taken
+snapshot_refresh_rows = 5000
+# Storage engine behind load_data/save_data: "sqlite" (default), "excel", or
+# "service" to use the registry service at service_url (see service.py)
+storage_backend = os.environ.get("REGISTRY_BACKEND", "sqlite")
+service_url = os.environ.get("REGISTRY_URL", "http://127.0.0.1:8600")
+
+# Helper function to calculate time in months
+def calculate_months(start_date, end_date):
+    return (end_date.year - start_date.year) * 12 + (end_date.month - start_date.month)
+
+# Storage backend selected by storage_backend, created once per process
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = open_backend(storage_backend, service_url if storage_backend == "service" else database_file, excel_file)
+            migrate_from_excel(excel_file, _backend)
+        return _backend
+
+# Point the process at other storage (tools and benchmarks); the backend and
+# the cached store are recreated on next use. The old store's writer commits
+# what is queued and stops, so no writer thread outlives its store.
+def configure(database=None, snapshot=None, backend=None, excel=None, url=None):
+    global database_file, snapshot_file, storage_backend, excel_file, service_url, _backend, _store
+    with _backend_lock:
+        if _store is not None:
+            _store.writer.close()
+            _store = None
+        if url is not None:
+            service_url = url
+        if database is not None:
+            database_file = database
+        if snapshot is not None:
+            snapshot_file = snapshot
+        if backend is not None:
+            storage_backend = backend
+        if excel is not None:
+            excel_file = excel
+        _backend = None
+    get_registry_store.clear()
+
+# Load existing data or create a new DataFrame
+def load_data():
+    with get_metrics().timed("load_data"):
+        return get_backend().load()
+
+# Function to safely retrieve data, handling NaN values
+def safe_get(data, key, default=""):
+    value = data.get(key, default)
+    return value if pd.notna(value) else default
+
+# Function to safely retrieve a list, from a typed list column or a stored string value
+def safe_get_list(data, key):
+    value = data.get(key, "")
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [str(item) for item in value]
+    if pd.isna(value) or not isinstance(value, str):
+        return []
+    return [item.strip() for item in value.replace("[", "").replace("]", "").replace("'", "").split(",") if item]
+
+# Function to safely retrieve a date, from a typed datetime column or a stored string value
+def safe_get_date(data, key, default):
+    value = data.get(key)
+    if isinstance(value, str):
+        value = pd.to_datetime(value, errors="coerce", format="ISO8601")
+    if value is None or pd.isna(value):
+        return default
+    return value.date()
+
+# Normalize MRNs the same way for stored rows and for user input
+def normalize_mrn(mrn):
+    return str(mrn).strip()
+
+
+# In-memory copy of the registry, shared by every session of this process.
+# The frame is typed (see snapshot.to_typed), so rendering a patient never
+# re-parses dates or list strings. The backend is only re-read when its
+# signature changes (a write from another process, or the workbook edited by
+# hand), and backends that can list the rows written since a signature are
+# caught up incrementally instead of reloaded. A cold start memory-maps the
+# Parquet snapshot and only reads the rows written after it from storage.
+# Saved rows go to a tail list and the visit index, so a save or an MRN lookup
+# never copies or scans the whole registry; the tail is folded into the frame
+# only when a caller asks for the full frame.
+class RegistryStore:
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.RLock()
+        self.version = 0
+        self.index = VisitIndex()
+        self.search = MRNSearchIndex()
+        self._df = None
+        self._tail = []
+        self._tail_rows = []
+        self._signature = None
+        self.writer = GroupCommitWriter(self._commit)
+
+    # Typed frame for the storage state `signature`, from the snapshot when it is usable
+    def _load_typed(self, signature):
+        identity = self.backend.identity()
+        if snapshot_file and os.path.exists(snapshot_file):
+            df, metadata = read_snapshot(snapshot_file)
+            if metadata.get("identity") == identity:
+                if same_signature(metadata.get("signature"), signature):
+                    return df
+                new_rows = self.backend.load_since(metadata.get("signature"), signature)
+                if new_rows is not None:
+                    df = concat_typed([df, to_typed(new_rows)])
+                    if len(new_rows) >= snapshot_refresh_rows:
+                        write_snapshot(df, snapshot_file, signature, identity)
+                    return df
+        df = to_typed(self.backend.load())
+        if snapshot_file:
+            write_snapshot(df, snapshot_file, signature, identity)
+        return df
+
+    def _reload(self, signature):
+        with get_metrics().timed("cache.reload"):
+            df = self._load_typed(signature)
+            self._df = df
+            self._tail = []
+            self._tail_rows = []
+            self.index = VisitIndex.from_frame(df)
+            self.search = MRNSearchIndex(self.index.mrns())
+            self._signature = signature
+            self.version += 1
+
+    def _add_rows(self, rows):
+        if not rows:
+            return
+        for row in rows:
+            record = to_typed_record(row)
+            self.index.add(record["MRN"], row.get("Follow_up_date"), len(self._df) + len(self._tail))
+            self.search.add(record["MRN"])
+            self._tail.append(record)
+            self._tail_rows.append(row)
+        self.version += 1
+
+    # Large batches (e.g. a bulk import by another process) are typed and indexed
+    # in one go, and refresh the snapshot when they are big enough
+    def _add_frame(self, rows, signature):
+        self._fold_tail()
+        typed = to_typed(rows)
+        self.index.extend(typed, start=len(self._df))
+        self.search.update(typed["MRN"].astype(str).unique())
+        self._df = concat_typed([self._df, typed])
+        self.version += 1
+        if snapshot_file and len(rows) >= snapshot_refresh_rows:
+            write_snapshot(self._df, snapshot_file, signature, self.backend.identity())
+
+    def _fold_tail(self):
+        if self._tail_rows:
+            self._df = concat_typed([self._df, to_typed(pd.DataFrame(self._tail_rows))])
+            self._tail = []
+            self._tail_rows = []
+
+    # Bring the cache up to date with the storage
+    def _refresh(self):
+        metrics = get_metrics()
+        signature = self.backend.signature()
+        if self._df is not None and signature == self._signature:
+            metrics.count("cache.hits")
+            return
+        new_rows = self.backend.load_since(self._signature, signature) if self._df is not None else None
+        if new_rows is None:
+            metrics.count("cache.reloads")
+            self._reload(signature)
+        else:
+            metrics.count("cache.catch_ups")
+            with metrics.timed("cache.catch_up"):
+                self._catch_up(new_rows, signature)
+            self._signature = signature
+
+    def _catch_up(self, new_rows, signature):
+        if len(new_rows) > 100:
+            self._add_frame(new_rows, signature)
+        else:
+            self._add_rows(new_rows.to_dict("records"))
+
+    # Current typed registry frame; reloads only if the storage changed since last read
+    def data(self):
+        with self.lock:
+            self._refresh()
+            self._fold_tail()
+            return self._df
+
+    # The frame with a key that changes whenever its content does: the storage
+    # identity and signature, which, unlike version, stay valid across stores
+    def data_with_key(self):
+        with self.lock:
+            df = self.data()
+            return df, (self.backend.identity(), self._signature)
+
+    def _row(self, position):
+        if position is None:
+            return None
+        if position < len(self._df):
+            row = self._df.iloc[position].to_dict()
+        else:
+            row = dict(self._tail[position - len(self._df)])
+        return {key: value for key, value in row.items() if not key.endswith(RAW_SUFFIX)}
+
+    # Most recent visit of a patient, or None for an unknown MRN
+    def get_patient(self, mrn):
+        with get_metrics().timed("lookup.patient"), self.lock:
+            self._refresh()
+            return self._row(self.index.latest(normalize_mrn(mrn)))
+
+    # Latest visit of each MRN (None for unknown ones), checking the storage once
+    # and taking the cached rows out of the frame in one go
+    def get_patients(self, mrns):
+        with get_metrics().timed("lookup.patients"), self.lock:
+            self._refresh()
+            positions = [self.index.latest(normalize_mrn(mrn)) for mrn in mrns]
+            cached = sorted({p for p in positions if p is not None and p < len(self._df)})
+            columns = [column for column in self._df.columns if not column.endswith(RAW_SUFFIX)]
+            rows = dict(zip(cached, self._df[columns].take(cached).to_dict("records")))
+            return [rows[p] if p in rows else self._row(p) for p in positions]
+
+    # All visits of a patient, oldest first
+    def get_visits(self, mrn):
+        with self.lock:
+            self._refresh()
+            return [self._row(position) for position in self.index.visits(normalize_mrn(mrn))]
+
+    # Follow-up dates of a patient's visits, oldest first
+    def get_visit_dates(self, mrn):
+        with self.lock:
+            self._refresh()
+            return self.index.dates(normalize_mrn(mrn))
+
+    # The visit in effect on a date: the latest one on or before it
+    def get_visit_at(self, mrn, on_date):
+        with self.lock:
+            self._refresh()
+            return self._row(self.index.visit_at(normalize_mrn(mrn), on_date))
+
+    def has_patient(self, mrn):
+        with self.lock:
+            self._refresh()
+            return normalize_mrn(mrn) in self.index
+
+    # Known MRNs starting with prefix, for autocomplete
+    def search_mrns(self, prefix, limit=20):
+        with self.lock:
+            self._refresh()
+            return self.search.prefix(normalize_mrn(prefix), limit)
+
+    # Known MRNs within one edit of mrn, other than mrn itself
+    def similar_mrns(self, mrn, limit=20):
+        with self.lock:
+            self._refresh()
+            return self.search.similar(normalize_mrn(mrn), limit)
+
+    # Runs on the writer thread: one group commit for every save queued meanwhile.
+    # Items are (row, author) pairs.
+    def _commit(self, items):
+        rows = [row for row, _ in items]
+        metrics = get_metrics()
+        metrics.count("saves", len(rows))
+        metrics.count("save_batches")
+        with metrics.timed("save.commit"), self.lock:
+            self._refresh()
+            previous = self._signature
+            row_ids = self.backend.append(rows, [author for _, author in items])
+            signature = self.backend.signature()
+            # Rows written by other processes in the meantime come back too
+            new_rows = self.backend.load_since(previous, signature)
+            if new_rows is None:
+                self._add_rows(rows)
+            else:
+                self._catch_up(new_rows, signature)
+            self._signature = signature
+            return row_ids
+
+    # Queue a row for the writer and wait until it is committed
+    def append(self, data, author=None):
+        row = {key: to_cell(value) for key, value in data.items()}
+        with get_metrics().timed("save"):
+            return self.writer.submit((row, author)).result()
+
+    # Queue many rows (e.g. one chunk of a bulk import) to be committed together
+    # by the writer and wait for it; returns one row id per row, like backend.append
+    def append_rows(self, rows, authors=None):
+        items = [({key: to_cell(value) for key, value in row.items()}, author)
+                 for row, author in zip(rows, authors or [None] * len(rows))]
+        with get_metrics().timed("save.rows"):
+            return [receipt.row_id for receipt in self.writer.submit_many(items).result()]
+
+    # Visits held in memory, without touching the storage
+    def row_count(self):
+        with self.lock:
+            return (len(self._df) if self._df is not None else 0) + len(self._tail)
+
+    # Who changed which cells of a patient's record and when, oldest first;
+    # None if the backend keeps no history
+    def history(self, mrn):
+        return self.backend.history(normalize_mrn(mrn))
+
+    # Typed registry as it stood at `when` (naive times are UTC), materialized
+    # from storage; None if the backend keeps no history
+    def data_as_of(self, when):
+        until = self.backend.row_as_of(when)
+        if until is None:
+            return None
+        return to_typed(self.backend.load_since(None, until))
+
+    # Drop the cached frame so the next access re-reads the storage
+    def invalidate(self):
+        with self.lock:
+            self._df = None
+            self._tail = []
+            self._tail_rows = []
+            self._signature = None
+
+
+# Size of the storage on disk, including a SQLite write-ahead log
+def storage_bytes(backend):
+    return sum(os.path.getsize(path) for path in (backend.path, f"{backend.path}-wal") if os.path.exists(path))
+
+# The cached store, so configure() can stop its writer
+_store = None
+
+@st.cache_resource
+def get_registry_store():
+    global _store
+    store = _store = RegistryStore(get_backend())
+    metrics = get_metrics()
+    metrics.gauge("rows", store.row_count)
+    metrics.gauge("storage_bytes", lambda: storage_bytes(store.backend))
+    metrics.gauge("save.queue", store.writer.pending)
+    start_exporters()
+    return store
+
+
+# Function to fetch the latest visit of a patient by MRN
+def get_patient_data(mrn):
+    return get_registry_store().get_patient(mrn)
+
+# Function to fetch every visit of a patient, oldest first
+def get_patient_visits(mrn):
+    return get_registry_store().get_visits(mrn)
+
+# Function to list the follow-up dates of a patient, oldest first
+def get_patient_visit_dates(mrn):
+    return get_registry_store().get_visit_dates(mrn)
+
+# Function to fetch the visit of a patient in effect on a given date
+def get_patient_visit_at(mrn, on_date):
+    return get_registry_store().get_visit_at(mrn, on_date)
+
+# Function to check whether an MRN is already in the registry
+def patient_exists(mrn):
+    return get_registry_store().has_patient(mrn)
+
+# Function to list known MRNs starting with what has been typed so far
+def search_mrns(prefix, limit=20):
+    return get_registry_store().search_mrns(prefix, limit)
+
+# Function to find existing MRNs one typo away from an MRN
+def find_similar_mrns(mrn, limit=20):
+    return get_registry_store().similar_mrns(mrn, limit)
+
+# Function to list who changed what in a patient's record, and when
+def get_patient_history(mrn):
+    return get_registry_store().history(mrn)
+
+# Function to rebuild the whole registry as it stood at a point in time
+def load_data_as_of(when):
+    return get_registry_store().data_as_of(when)
+
+# Function to save patient data (Appending Instead of Overwriting)
+def save_data(data, author=None):
+    data["MRN"] = normalize_mrn(data["MRN"])
+
+    # Append new data as a separate row instead of replacing the existing one.
+    # Only the cells that changed since the patient's last visit are stored,
+    # with author and time for the audit trail. Returns a SaveReceipt once the
+    # row is committed.
+    return get_registry_store().append(data, author)
@@ -0,0 +1,81 @@
+# Column set and vocabularies of the registry, shared by storage, the form and analytics
+
+REGISTRY_COLUMNS = [
+    "MRN", "Date_of_Birth", "Age", "Date_of_Last_Radiotherapy", "Follow_up_date", "Follow_up_time",
+    "Histology", "Grade", "Tumor_Focality", "Clinical_Stage", "Type_of_Confirmatory_procedure", "Biopsy_date",
+    "Recurrent_Tumor", "Recurrence_date", "Surgery_type", "Surgery_date", "Systemic_Treatment", "Systemic_Treatment_first_date", "Systemic_Treatment_last_date",
+    "Dose", "Fractionation", "Dysuria", "Cystitis", "Bladder_Perforation", "Hematuria", "Urinary_Fistula", "Urinary_Obstruction", "Ureteral_Stenosis", "Diarrhea", "Nausea", "Bowel_Perforation", "Bowel_Obstruction", "Fatigue", "Overal_tolerance",
+    "Local_recurrence", "Regional_recurrence", "Distant_recurrence", "Death", "time_to_local_recurrence", "time_to_regional_recurrence", "time_to_distant_recurrence", "time_to_death"
+]
+
+DATE_COLUMNS = [
+    "Date_of_Birth", "Date_of_Last_Radiotherapy", "Follow_up_date", "Biopsy_date", "Recurrence_date", "Surgery_date",
+    "Systemic_Treatment_first_date", "Systemic_Treatment_last_date",
+]
+
+# Months and years; the capitalised Time_to_* columns are the ones the form has been saving
+NUMERIC_COLUMNS = [
+    "Age", "Follow_up_time", "time_to_local_recurrence", "time_to_regional_recurrence", "time_to_distant_recurrence", "time_to_death",
+    "Time_to_local_recurrence", "Time_to_regional_recurrence", "Time_to_distant_recurrence",
+]
+
+# Multi-select options
+HISTOLOGY_OPTIONS = ["Renal Cell Carcinoma", "Papilary Renal Cell Tumors", "Oncocytic and chromophobe renal tumors", "Renal mesenchymal tumors", "Other renal tumors"]
+CLINICAL_STAGE_OPTIONS = ["cT0", "cTx", "cT1a", "cT1b", "cT2a", "cT2b", "cT3a", "cT3b", "cT3c", "cT4", "cN0", "cN1", "M0", "M1"]
+SYSTEMIC_TREATMENT_OPTIONS = ["None", "Conventional Chemotherapy", "Target Therapy", "Immunotherapy", "Radioligant", "ADC", "Others"]
+DOSE_OPTIONS = ["26Gy", "35Gy", "40Gy", "30Gy", "Others"]
+FRACTIONATION_OPTIONS = ["1", "2", "3", "5", "10", "Others"]
+
+LIST_OPTIONS = {
+    "Histology": HISTOLOGY_OPTIONS,
+    "Clinical_Stage": CLINICAL_STAGE_OPTIONS,
+    "Systemic_Treatment": SYSTEMIC_TREATMENT_OPTIONS,
+    "Dose": DOSE_OPTIONS,
+    "Fractionation": FRACTIONATION_OPTIONS,
+}
+LIST_COLUMNS = list(LIST_OPTIONS)
+
+# Single-choice options
+NO_YES = ["No", "Yes"]
+CTCAE_GRADES = ["Absent", "I", "II", "III", "IV", "V"]
+CTCAE_GRADES_FROM_II = ["Absent", "II", "III", "IV", "V"]
+
+CATEGORIES = {
+    "Grade": ["I", "II", "III", "IV", "Not Reported"],
+    "Tumor_Focality": ["Unifocal", "Multifocal", "Not Reported"],
+    "Type_of_Confirmatory_procedure": ["Biopsy", "Partial Nephrectomy", "Radical Nephrectomy", "Image Only", "Others"],
+    "Recurrent_Tumor": NO_YES,
+    "Surgery_type": ["Partial Nephrectomy", "Radical Nephrectomy", "Others"],
+    "Dysuria": ["Present", "Absent"],
+    "Cystitis": ["None", "I", "II", "III", "IV", "V"],
+    "Bladder_Perforation": CTCAE_GRADES_FROM_II,
+    "Hematuria": CTCAE_GRADES,
+    "Urinary_Fistula": CTCAE_GRADES_FROM_II,
+    "Urinary_Obstruction": CTCAE_GRADES,
+    "Ureteral_Stenosis": ["Absent", "Present"],
+    "Diarrhea": CTCAE_GRADES,
+    "Nausea": CTCAE_GRADES,
+    "Bowel_Perforation": CTCAE_GRADES_FROM_II,
+    "Bowel_Obstruction": CTCAE_GRADES,
+    "Fatigue": ["None", "I", "II", "III"],
+    "Overal_tolerance": ["Excellent", "Good", "Fair", "Poor"],
+    "Local_recurrence": NO_YES,
+    "Regional_recurrence": NO_YES,
+    "Distant_recurrence": NO_YES,
+    "Death": NO_YES,
+    "Cancer Related Death": NO_YES,
+}
+
+# Graded toxicities, worst grade last in each vocabulary
+CTCAE_COLUMNS = [
+    "Cystitis", "Bladder_Perforation", "Hematuria", "Urinary_Fistula", "Urinary_Obstruction",
+    "Diarrhea", "Nausea", "Bowel_Perforation", "Bowel_Obstruction", "Fatigue",
+]
+
+# Outcome flag column -> stored months-to-event columns (schema name first, then the form's)
+EVENT_COLUMNS = {
+    "Local_recurrence": ["time_to_local_recurrence", "Time_to_local_recurrence"],
+    "Regional_recurrence": ["time_to_regional_recurrence", "Time_to_regional_recurrence"],
+    "Distant_recurrence": ["time_to_distant_recurrence", "Time_to_distant_recurrence"],
+    "Death": ["time_to_death"],
+}
@@ -0,0 +1,297 @@
+import argparse
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import registry
+from bulk_import import map_columns, validate_chunk
+from form_schema import FIELDS, calculated_values, validate
+from metrics import get_metrics
+from storage import to_cell
+
+# Registry service: the registry behind a local HTTP/JSON API, so several
+# Streamlit replicas (REGISTRY_BACKEND=service) and batch clients share one
+# store. Endpoints (GET unless noted; JSON in and out):
+#
+#   /health                      {"status": "ok"}
+#   /registry                    identity, signature, columns and row count
+#   /signature                   highest row id, for cache checks
+#   /rows?after=&until=          flat rows after signature `after` (JSON), up to `until`;
+#                                null if the storage cannot list rows since a signature
+#   POST /visits                 {"rows": [...], "authors": [...]} -> {"row_ids": [...]};
+#                                checked like a bulk import, nothing is saved if a row fails
+#   POST /patients               {"mrns": [...]} -> latest visit of each (or null)
+#   POST /patients/visits        {"mrns": [...]} -> every visit of each, oldest first
+#   /mrns/search?prefix=&limit=  known MRNs starting with prefix
+#   /mrns/similar?mrn=&limit=    known MRNs one edit away
+#   /history?mrn=                a patient's audit trail
+#   /as-of?when=                 last row id saved at or before an ISO time
+#   POST /calculate              {"visits": [...]} -> errors and calculated values of each
+#   /metrics, /metrics.json      the service's own metrics
+
+log = logging.getLogger("registry.service")
+
+_PLAIN = (str, int, float, type(None))
+
+
+# JSON form of a cell: typed rows hold lists, timestamps and pandas missing values
+def _json_value(value):
+    if type(value) in _PLAIN:
+        return None if value != value else value
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [str(item) for item in value]
+    if value is pd.NA:
+        return None
+    return to_cell(value)
+
+def _frame_json(df):
+    return {
+        "columns": [str(column) for column in df.columns],
+        "rows": [[_json_value(value) for value in row] for row in df.itertuples(index=False, name=None)],
+    }
+
+def _row_json(row):
+    return None if row is None else {key: _json_value(value) for key, value in row.items()}
+
+def _int(params, key, default=None):
+    return int(params[key]) if params.get(key) not in (None, "") else default
+
+# Storage signatures travel as JSON: a row id for SQLite, [mtime, size] for a workbook
+def _signature(params, key):
+    return json.loads(params[key]) if params.get(key) not in (None, "") else None
+
+# Rows checked against the registry columns and form vocabularies the way a
+# bulk import checks them; dates, numbers and options come back in their
+# stored form. Cells the check reads as empty ("N/A" and the like) are kept
+# as sent, so a replica's save stores exactly what a local save would.
+def _validated_rows(rows):
+    chunk = pd.DataFrame(rows, dtype=object).reset_index(drop=True)
+    renames, unmapped = map_columns(chunk.columns)
+    if unmapped:
+        raise ValueError(f"unknown columns: {', '.join(map(str, unmapped))}")
+    accepted, rejected = validate_chunk(chunk, renames, first_row=0)
+    if len(rejected):
+        raise ValueError("; ".join(f"row {row.Source_row}: {row.Errors}" for row in rejected.itertuples()))
+    cleaned = accepted.astype(object).where(accepted.notna(), chunk.rename(columns=renames))
+    return [
+        {renames[key]: cleaned.at[i, renames[key]] for key in row}
+        for i, row in enumerate(rows)
+    ]
+
+# Form values from JSON: date fields arrive as ISO strings
+def _form_values(visit):
+    values = dict(visit)
+    for field in FIELDS:
+        if field.kind == "date" and isinstance(values.get(field.key), str):
+            values[field.key] = date.fromisoformat(values[field.key])
+    return values
+
+
+def health(store, params, payload):
+    return {"status": "ok"}
+
+def registry_info(store, params, payload):
+    backend = store.backend
+    return {
+        "identity": backend.identity(),
+        "signature": backend.signature(),
+        # A workbook has no schema apart from its header row
+        "columns": backend.columns() if hasattr(backend, "columns") else [str(column) for column in backend.load().columns],
+        "rows": len(backend),
+    }
+
+def signature(store, params, payload):
+    return {"signature": store.backend.signature()}
+
+def rows(store, params, payload):
+    after, until = _signature(params, "after"), _signature(params, "until")
+    df = store.backend.load_since(after, until)
+    # Without a signature to start from, every row is wanted: a full load
+    if df is None and after is None:
+        df = store.backend.load()
+    return None if df is None else _frame_json(df)
+
+# Every client's saves go through the service's single writer, so batches
+# from different replicas share group commits and never race each other
+def save_visits(store, params, payload):
+    rows, authors = payload["rows"], payload.get("authors")
+    if authors is not None and len(authors) != len(rows):
+        raise ValueError("authors must have one entry per row")
+    rows = _validated_rows(rows)
+    for row in rows:
+        row["MRN"] = registry.normalize_mrn(row["MRN"])
+    return {"row_ids": store.append_rows(rows, authors)}
+
+def patients(store, params, payload):
+    mrns = payload["mrns"]
+    return {"patients": {mrn: _row_json(row) for mrn, row in zip(mrns, store.get_patients(mrns))}}
+
+def patient_visits(store, params, payload):
+    return {"visits": {mrn: [_row_json(visit) for visit in store.get_visits(mrn)] for mrn in payload["mrns"]}}
+
+def search_mrns(store, params, payload):
+    return {"mrns": store.search_mrns(params.get("prefix", ""), _int(params, "limit", 20))}
+
+def similar_mrns(store, params, payload):
+    return {"mrns": store.similar_mrns(params["mrn"], _int(params, "limit", 20))}
+
+def history(store, params, payload):
+    df = store.history(params["mrn"])
+    if df is None:
+        return None
+    df["saved_at"] = df["saved_at"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return _frame_json(df)
+
+# Naive times are UTC; times with an offset are converted to UTC first
+def as_of(store, params, payload):
+    when = pd.Timestamp(params["when"])
+    if when.tzinfo is not None:
+        when = when.tz_convert("UTC").tz_localize(None)
+    return {"row_id": store.backend.row_as_of(when)}
+
+def calculate(store, params, payload):
+    results = []
+    for visit in payload["visits"]:
+        values = _form_values(visit)
+        errors = validate(values)
+        calculated = None if errors else {key: _json_value(value) for key, value in calculated_values(values).items()}
+        results.append({"errors": errors, "calculated": calculated})
+    return {"results": results}
+
+def metrics_text(store, params, payload):
+    return get_metrics().to_prometheus()
+
+def metrics_json(store, params, payload):
+    return json.loads(get_metrics().to_json())
+
+
+GET_ROUTES = {
+    "/health": health,
+    "/registry": registry_info,
+    "/signature": signature,
+    "/rows": rows,
+    "/mrns/search": search_mrns,
+    "/mrns/similar": similar_mrns,
+    "/history": history,
+    "/as-of": as_of,
+    "/metrics": metrics_text,
+    "/metrics.json": metrics_json,
+}
+
+POST_ROUTES = {
+    "/visits": save_visits,
+    "/patients": patients,
+    "/patients/visits": patient_visits,
+    "/calculate": calculate,
+}
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    # A stalled client cannot hold a worker for longer than this
+    timeout = 60
+
+    def do_GET(self):
+        self._dispatch(GET_ROUTES)
+
+    def do_POST(self):
+        self._dispatch(POST_ROUTES)
+
+    def _dispatch(self, routes):
+        url = urlparse(self.path)
+        route = routes.get(url.path)
+        if route is None:
+            self._send(404, {"error": f"no such endpoint: {self.command} {url.path}"})
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            payload = None
+            if self.command == "POST":
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with get_metrics().timed(f"api.{route.__name__}"):
+                body = route(self.server.store, params, payload)
+        except (KeyError, ValueError, TypeError) as error:
+            self._send(400, {"error": f"{type(error).__name__}: {error}"})
+        except Exception as error:
+            log.exception("%s %s failed", self.command, self.path)
+            self._send(500, {"error": f"{type(error).__name__}: {error}"})
+        else:
+            self._send(200, body)
+
+    def _send(self, status, body):
+        if isinstance(body, str):
+            data, content_type = body.encode(), "text/plain; version=0.0.4"
+        else:
+            data, content_type = json.dumps(body, allow_nan=False).encode(), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+# Requests run on a fixed pool of worker threads rather than a thread each.
+# Storage connections are per thread, so every worker keeps one open for its
+# lifetime and the pool doubles as the storage connection pool. Lookups are
+# answered from the process-wide RegistryStore cache, and every client writes
+# through this one process, so replicas all see the same registry.
+class RegistryServer(HTTPServer):
+    # Connections waiting for a worker; the default of 5 resets busy clients
+    request_queue_size = 128
+
+    def __init__(self, address, store, workers=8):
+        super().__init__(address, RegistryHandler)
+        self.store = store
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="registry-service")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the registry over a local HTTP/JSON API.")
+    parser.add_argument("--database", default=registry.database_file, help="registry database (workbook with --backend excel)")
+    parser.add_argument("--snapshot", default=registry.snapshot_file, help='typed Parquet snapshot ("" disables it)')
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "excel"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=8, help="worker threads, each with its own storage connection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    registry.configure(
+        database=args.database,
+        snapshot=args.snapshot,
+        backend=args.backend,
+        excel=args.database if args.backend == "excel" else None,
+    )
+    store = registry.get_registry_store()
+    log.info("loaded %d visits from %s", len(store.data()), args.database)
+    server = RegistryServer((args.host, args.port), store, args.workers)
+    log.info("serving on http://%s:%d with %d workers", args.host, args.port, args.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from registry_schema import CATEGORIES, DATE_COLUMNS, LIST_COLUMNS, NUMERIC_COLUMNS
+
+# Values that do not parse into their column's type are kept verbatim here,
+# so converting back to the flat format is lossless
+RAW_SUFFIX = "__raw"
+LIST_TYPE = pd.ArrowDtype(pa.list_(pa.string()))
+_METADATA_KEY = b"registry"
+
+
+def _missing(values):
+    return values.isna() | values.astype(object).eq("")
+
+def _keep_raw(df, column, original, parsed_missing):
+    raw = original.where(~_missing(original) & parsed_missing)
+    if raw.notna().any():
+        df[column + RAW_SUFFIX] = raw.astype(str).where(raw.notna(), None).astype(object)
+
+# "['a', 'b']" strings (the stored form of multi-selects) to a list<string> column
+def _parse_lists(values):
+    is_list_string = values.astype(object).str.startswith("[").eq(True)
+    strings = pa.array(values.where(is_list_string, None).astype(object), type=pa.string(), from_pandas=True)
+    cleaned = pc.utf8_trim_whitespace(pc.replace_substring_regex(strings, r"[\[\]']", ""))
+    parts = pc.split_pattern_regex(cleaned, r"\s*,\s*")
+    empty = pa.scalar([], type=pa.list_(pa.string()))
+    lists = pc.if_else(pc.equal(cleaned, ""), empty, parts)
+    return pd.Series(pd.arrays.ArrowExtensionArray(lists), index=values.index), ~is_list_string
+
+# Inverse of _parse_lists: list<string> column back to "['a', 'b']" strings
+def _format_lists(values):
+    lists = pa.array(values.array) if isinstance(values.dtype, pd.ArrowDtype) else pa.array(values.tolist(), type=pa.list_(pa.string()))
+    joined = pc.binary_join(lists, "', '")
+    formatted = pc.if_else(
+        pc.equal(pc.list_value_length(lists), 0),
+        pa.scalar("[]"),
+        pc.binary_join_element_wise("['", joined, "']", ""),
+    )
+    return pd.Series(formatted.to_pandas(), index=values.index).astype(object).where(lambda s: s.notna(), None)
+
+
+# Single-choice columns as categoricals whose categories start with the fixed
+# vocabulary, followed by any other values actually present
+def _ensure_vocabulary(df):
+    for column, vocabulary in CATEGORIES.items():
+        if column not in df:
+            continue
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            categories = list(df[column].cat.categories)
+            if categories[: len(vocabulary)] != vocabulary:
+                extra = sorted(set(categories) - set(vocabulary))
+                df[column] = df[column].cat.set_categories(vocabulary + extra)
+        else:
+            values = df[column].astype(object).where(df[column].notna(), None)
+            extra = sorted(set(values.dropna().unique()) - set(vocabulary))
+            df[column] = pd.Categorical(values, categories=vocabulary + extra)
+    return df
+
+
+# Convert a flat registry frame (strings as stored by the backends) into typed columns:
+# dates as datetime64, numbers as nullable numbers, single-choice fields as
+# categoricals over their fixed vocabulary (plus any other values seen), and
+# multi-select fields as native list<string> columns.
+def to_typed(df):
+    df = df.copy()
+    if "MRN" in df:
+        df["MRN"] = df["MRN"].astype(str).str.strip()
+    for column in DATE_COLUMNS:
+        if column in df:
+            original = df[column]
+            parsed = pd.to_datetime(original.astype(str).where(~_missing(original), None), errors="coerce", format="ISO8601")
+            df[column] = parsed
+            _keep_raw(df, column, original, parsed.isna())
+    for column in NUMERIC_COLUMNS:
+        if column in df:
+            original = df[column]
+            parsed = pd.to_numeric(original.where(~_missing(original), None), errors="coerce")
+            whole = parsed.dropna()
+            df[column] = parsed.astype("Int64") if (whole == whole.round()).all() else parsed.astype("Float64")
+            _keep_raw(df, column, original, parsed.isna())
+    for column in CATEGORIES:
+        if column in df:
+            df[column] = df[column].where(~_missing(df[column]), None).map(str, na_action="ignore")
+    _ensure_vocabulary(df)
+    for column in LIST_COLUMNS:
+        if column in df:
+            original = df[column]
+            lists, unparsed = _parse_lists(original)
+            df[column] = lists
+            _keep_raw(df, column, original, unparsed)
+    # Any other column that mixes strings and numbers becomes text, as Parquet needs one type per column
+    typed = {"MRN", *DATE_COLUMNS, *NUMERIC_COLUMNS, *CATEGORIES, *LIST_COLUMNS}
+    for column in df.columns:
+        if column not in typed and df[column].dtype == object:
+            kinds = df[column].dropna().map(type).unique()
+            if len(kinds) > 1:
+                df[column] = df[column].map(str, na_action="ignore")
+    return df
+
+def _is_missing(value):
+    return value is None or value == "" or (not isinstance(value, (str, list, tuple)) and pd.isna(value))
+
+# Same conversion as to_typed for a single stored row, without the per-column
+# pandas overhead; used for rows saved while the app is running
+def to_typed_record(row):
+    record = dict(row)
+    raw = {}
+    if "MRN" in record:
+        record["MRN"] = str(record["MRN"]).strip()
+    for column in DATE_COLUMNS:
+        if column in record:
+            value = record[column]
+            parsed = None if _is_missing(value) else pd.to_datetime(str(value), errors="coerce", format="ISO8601")
+            record[column] = None if parsed is None or pd.isna(parsed) else parsed
+            if record[column] is None and not _is_missing(value):
+                raw[column] = str(value)
+    for column in NUMERIC_COLUMNS:
+        if column in record:
+            value = record[column]
+            parsed = None if _is_missing(value) else pd.to_numeric(value, errors="coerce")
+            record[column] = None if parsed is None or pd.isna(parsed) else (int(parsed) if parsed == int(parsed) else float(parsed))
+            if record[column] is None and not _is_missing(value):
+                raw[column] = str(value)
+    for column in CATEGORIES:
+        if column in record:
+            record[column] = None if _is_missing(record[column]) else str(record[column])
+    for column in LIST_COLUMNS:
+        if column in record:
+            value = record[column]
+            if isinstance(value, str) and value.startswith("["):
+                cleaned = value.replace("[", "").replace("]", "").replace("'", "").strip()
+                record[column] = [item.strip() for item in cleaned.split(",")] if cleaned else []
+            else:
+                record[column] = None
+                if not _is_missing(value):
+                    raw[column] = str(value)
+    for column, value in raw.items():
+        record[column + RAW_SUFFIX] = value
+    return record
+
+# Convert a typed frame back to the flat format written to storage and Excel
+def to_flat(df):
+    df = df.copy()
+    for column in DATE_COLUMNS:
+        if column in df:
+            df[column] = df[column].dt.strftime("%Y-%m-%d").astype(object).where(df[column].notna(), None)
+    for column in NUMERIC_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype(object).where(df[column].notna(), None)
+    for column in CATEGORIES:
+        if column in df:
+            df[column] = df[column].astype(object).where(df[column].notna(), None)
+    for column in LIST_COLUMNS:
+        if column in df:
+            df[column] = _format_lists(df[column])
+    for column in [column for column in df.columns if column.endswith(RAW_SUFFIX)]:
+        target = column[: -len(RAW_SUFFIX)]
+        df[target] = df[column].where(df[column].notna(), df[target])
+        df = df.drop(columns=column)
+    return df
+
+# Concatenate typed frames, keeping categorical columns categorical
+def concat_typed(frames):
+    columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+    # All-empty columns would otherwise decide the result dtype
+    df = pd.concat([frame.dropna(axis=1, how="all") for frame in frames], ignore_index=True)
+    df = df.reindex(columns=columns)
+    for column in columns:
+        if df[column].isna().all():
+            dtype = next(frame[column].dtype for frame in frames if column in frame)
+            df[column] = pd.array([None] * len(df), dtype=dtype)
+    return _ensure_vocabulary(df)
+
+
+# Write a typed frame as a Parquet snapshot, tagged with the storage state it reflects
+def write_snapshot(df, path, signature=None, identity=None):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_METADATA_KEY] = json.dumps({"signature": signature, "identity": identity}).encode()
+    table = table.replace_schema_metadata(metadata)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(suffix=".parquet", dir=directory)
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Memory-map a snapshot; returns (typed frame, {"signature": ..., "identity": ...})
+def read_snapshot(path):
+    table = pq.read_table(path, memory_map=True)
+    metadata = json.loads((table.schema.metadata or {}).get(_METADATA_KEY, b"{}"))
+    df = table.to_pandas(types_mapper=lambda arrow_type: LIST_TYPE if pa.types.is_list(arrow_type) else None)
+    # Parquet only keeps the categories that occur, so put the full vocabularies back
+    return _ensure_vocabulary(df), metadata
+
+# Signatures go through JSON in the snapshot, so compare them in that form
+def same_signature(a, b):
+    return json.loads(json.dumps(a)) == json.loads(json.dumps(b))
+
+
+def excel_to_snapshot(excel_file, path):
+    df = to_typed(pd.read_excel(excel_file))
+    write_snapshot(df, path)
+    return len(df)
+
+def snapshot_to_excel(path, excel_file):
+    df, _ = read_snapshot(path)
+    to_flat(df).to_excel(excel_file, index=False)
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert registry workbooks to and from typed Parquet snapshots.")
+    parser.add_argument("command", choices=["to-parquet", "to-excel"])
+    parser.add_argument("source")
+    parser.add_argument("target")
+    args = parser.parse_args()
+
+    if args.command == "to-parquet":
+        count = excel_to_snapshot(args.source, args.target)
+    else:
+        count = snapshot_to_excel(args.source, args.target)
+    print(f"{args.command}: {count} rows")
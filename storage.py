@@ -0,0 +1,583 @@
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from registry_schema import REGISTRY_COLUMNS
+
+
+# Convert a value from the form or a workbook into what gets stored.
+# Lists keep the str() form the workbook has always used, dates become ISO strings.
+def to_cell(value):
+    if isinstance(value, (list, tuple)):
+        return str(list(value))
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, (float, np.floating)) and np.isnan(value):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+# Registry columns first, then any extra keys in the order they first appear
+def _ordered_columns(columns):
+    extra = [column for column in columns if column not in REGISTRY_COLUMNS]
+    return REGISTRY_COLUMNS + extra
+
+def _empty_frame():
+    return pd.DataFrame(columns=REGISTRY_COLUMNS)
+
+
+# The original storage: the whole registry lives in one workbook that is
+# rewritten on every save. Kept for deployments that still want it.
+class ExcelBackend:
+    name = "excel"
+
+    def __init__(self, path):
+        self.path = path
+
+    def identity(self):
+        return os.path.abspath(self.path)
+
+    def signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self):
+        if os.path.exists(self.path):
+            return pd.read_excel(self.path)
+        return _empty_frame()
+
+    # The workbook has no notion of "rows since"; callers fall back to a full load
+    def load_since(self, signature, until=None):
+        return None
+
+    # The workbook can only be read whole; it is handed out in slices
+    def iter_chunks(self, chunk_size=10_000, until=None):
+        df = self.load()
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size].reset_index(drop=True)
+
+    # The workbook has no room for an audit trail, so authors are not kept
+    def append(self, rows, authors=None):
+        rows = [{key: to_cell(value) for key, value in row.items()} for row in rows]
+        df = pd.concat([self.load(), pd.DataFrame(rows)], ignore_index=True)
+        # Write next to the target and rename, so a crash never leaves half a workbook
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(suffix=".xlsx", dir=directory)
+        os.close(fd)
+        try:
+            df.to_excel(tmp_path, index=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return [None] * len(rows)
+
+    # Without saved rows there is no history and no earlier state to go back to
+    def history(self, mrn):
+        return None
+
+    def row_as_of(self, when):
+        return None
+
+    def __len__(self):
+        return len(self.load())
+
+
+# Cell types stored as they are; anything else goes through to_cell
+_PLAIN_TYPES = {str, int, float, type(None)}
+
+# Dictionary key of a stored value: text is told apart from numbers, so "1"
+# loads back as text, while equal numbers (1 and 1.0) are the same value
+def _value_key(value):
+    return (type(value) is str, value)
+
+# Changes of one visit, packed as (column id, value id) pairs; value id 0 is an empty cell
+CHANGE = np.dtype([("column", "<u2"), ("value", "<u4")])
+
+
+# Default storage: an embedded SQLite database holding a change log.
+# A patient's first visit records every filled-in cell (the baseline); each
+# later visit records only the cells that differ from the patient's previous
+# visit, so static fields such as Date_of_Birth or Histology are stored once.
+# Cell values are kept once each in a dictionary (registry_values) and a
+# visit's changes are a packed array of (column id, value id) pairs, which
+# loads decode with numpy and forward-fill per patient back into the flat
+# wide rows the rest of the app works with. Each visit also records when
+# (Unix time, UTC) and by whom it was saved. A save reads the patient's earlier
+# visits and inserts one row, so its cost does not depend on the registry size.
+class SQLiteBackend:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reset_dictionaries()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS registry_meta (key TEXT PRIMARY KEY, value)")
+            conn.execute("CREATE TABLE IF NOT EXISTS registry_columns (column_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE COLLATE NOCASE)")
+            conn.execute("CREATE TABLE IF NOT EXISTS registry_values (value_id INTEGER PRIMARY KEY, value)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS visit_changes (row_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "MRN TEXT NOT NULL, saved_at INTEGER, saved_by TEXT, changes BLOB NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS visit_changes_mrn ON visit_changes (MRN)")
+            conn.executemany("INSERT OR IGNORE INTO registry_columns (name) VALUES (?)", ((column,) for column in REGISTRY_COLUMNS))
+            conn.execute("INSERT OR IGNORE INTO registry_meta (key, value) VALUES ('registry_id', ?)", (uuid.uuid4().hex,))
+        self._migrate_wide_table()
+
+    # One connection per thread; sqlite3 connections must not be shared across threads
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Databases from before the change log hold one full row per visit in a
+    # `visits` table; it is re-encoded with the same row ids (so snapshots stay
+    # valid) and dropped. The whole database is first copied next to it
+    # (<path>.before-change-log, recorded as migration_backup), so the old
+    # table can always be recovered.
+    def _migrate_wide_table(self):
+        conn = self._connection()
+        if not self._has_wide_table(conn):
+            return
+        backup_path = f"{self.path}.before-change-log"
+        if not os.path.exists(backup_path):
+            backup = sqlite3.connect(backup_path)
+            try:
+                conn.backup(backup)
+            finally:
+                backup.close()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if not self._has_wide_table(conn):
+                return
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(visits)") if row[1] != "row_id"]
+            select = ", ".join(_quote(column) for column in columns)
+            last = 0
+            while True:
+                chunk = conn.execute(f"SELECT row_id, {select} FROM visits WHERE row_id > ? ORDER BY row_id LIMIT 50000", (last,)).fetchall()
+                if not chunk:
+                    break
+                self._write(conn, [dict(zip(columns, values[1:])) for values in chunk], [values[0] for values in chunk], None, None)
+                last = chunk[-1][0]
+            conn.execute("DROP TABLE visits")
+            conn.execute("INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('migration_backup', ?)", (os.path.abspath(backup_path),))
+        conn.execute("VACUUM")
+
+    @staticmethod
+    def _has_wide_table(conn):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'visits'").fetchone() is not None
+
+    # Column and value dictionaries, cached per process and topped up from the database
+    def _reset_dictionaries(self):
+        self._column_ids = {}
+        self._column_names = {}
+        self._value_ids = {_value_key(None): 0}
+        self._values = [None]
+        self._value_array = None
+
+    def _sync_dictionaries(self, conn):
+        for column_id, name in conn.execute(
+            "SELECT column_id, name FROM registry_columns WHERE column_id > ? ORDER BY column_id", (max(self._column_names, default=0),)
+        ):
+            self._column_names[column_id] = name
+            self._column_ids.setdefault(name.lower(), column_id)
+        for value_id, value in conn.execute(
+            "SELECT value_id, value FROM registry_values WHERE value_id >= ? ORDER BY value_id", (len(self._values),)
+        ):
+            self._values.append(value)
+            self._value_ids.setdefault(_value_key(value), value_id)
+
+    def _dictionaries(self):
+        with self._lock:
+            self._sync_dictionaries(self._connection())
+            if self._value_array is None or len(self._value_array) != len(self._values):
+                self._value_array = np.empty(len(self._values), dtype=object)
+                self._value_array[:] = self._values
+            return dict(self._column_names), self._value_array
+
+    # SQLite column names are case-insensitive, and so are registry columns: the
+    # form's Time_to_* keys are stored as the schema's time_to_* columns
+    def _column_id(self, name, new_columns):
+        column_id = self._column_ids.get(name.lower())
+        if column_id is None:
+            column_id = max(self._column_names, default=0) + 1
+            self._column_ids[name.lower()] = column_id
+            self._column_names[column_id] = name
+            new_columns.append((column_id, name))
+        return column_id
+
+    def _value_id(self, value, new_values):
+        if type(value) not in _PLAIN_TYPES:
+            value = to_cell(value)
+        if value is None or value != value:
+            return 0
+        value_id = self._value_ids.get(_value_key(value))
+        if value_id is None:
+            value_id = len(self._values)
+            self._values.append(value)
+            self._value_ids[_value_key(value)] = value_id
+            new_values.append((value_id, value))
+        return value_id
+
+    # Latest cell values (column id -> value id) of the given patients
+    def _patient_states(self, conn, mrns):
+        states = {}
+        for mrn, changes in conn.execute(
+            "SELECT MRN, changes FROM visit_changes WHERE MRN IN (SELECT value FROM json_each(?)) ORDER BY row_id",
+            (json.dumps(sorted(mrns)),),
+        ):
+            states.setdefault(mrn, {}).update(np.frombuffer(changes, dtype=CHANGE).tolist())
+        return states
+
+    # Encode rows against their patients' previous visits and insert them; runs
+    # inside the caller's write transaction
+    def _write(self, conn, rows, row_ids, saved_at, authors):
+        with self._lock:
+            self._sync_dictionaries(conn)
+            mrns = ["" if row.get("MRN") is None else str(row["MRN"]) for row in rows]
+            states = self._patient_states(conn, set(mrns))
+            new_columns, new_values, entries = [], [], []
+            # Rows with the same keys share one key -> column id lookup
+            layouts = {}
+            value_ids = self._value_ids
+            for row_id, mrn, row, author in zip(row_ids, mrns, rows, authors or itertools.repeat(None)):
+                keys = tuple(row)
+                layout = layouts.get(keys)
+                if layout is None:
+                    layout = layouts[keys] = [(key, self._column_id(key, new_columns)) for key in keys if key != "MRN"]
+                cells = {}
+                for key, column in layout:
+                    value = row[key]
+                    value_id = value_ids.get((type(value) is str, value)) if type(value) in _PLAIN_TYPES else None
+                    cells[column] = self._value_id(value, new_values) if value_id is None else value_id
+                state = states.setdefault(mrn, {})
+                changes = [(column, value) for column, value in cells.items() if state.get(column, 0) != value]
+                # Cells left out of the row are empty, as they would be in a flat table
+                changes += [(column, 0) for column, value in state.items() if value and column not in cells]
+                state.update(changes)
+                entries.append((row_id, mrn, saved_at, author, np.array(changes, dtype=CHANGE).tobytes()))
+            conn.executemany("INSERT INTO registry_columns (column_id, name) VALUES (?, ?)", new_columns)
+            conn.executemany("INSERT INTO registry_values (value_id, value) VALUES (?, ?)", new_values)
+            conn.executemany("INSERT INTO visit_changes (row_id, MRN, saved_at, saved_by, changes) VALUES (?, ?, ?, ?, ?)", entries)
+
+    # Random id created with the database, so caches can tell two databases apart
+    def identity(self):
+        return self.get_meta("registry_id")
+
+    def columns(self):
+        names, _ = self._dictionaries()
+        return [names[column_id] for column_id in sorted(names)]
+
+    # Highest row id; rows are never updated or deleted, so this changes on every write
+    def signature(self):
+        return self._connection().execute("SELECT MAX(row_id) FROM visit_changes").fetchone()[0]
+
+    def load(self):
+        return self.load_since(None)
+
+    # Change log entries after row `after` (up to and including until, at most
+    # limit of them) as (row_id, MRN, changes) tuples, preceded by the earlier
+    # visits of the same patients
+    def _read_changes(self, after, until, limit=-1):
+        conn = self._connection()
+        until = until if until is not None else 2**63 - 1
+        log = conn.execute(
+            "SELECT row_id, MRN, changes FROM visit_changes WHERE row_id > ? AND row_id <= ? ORDER BY row_id LIMIT ?",
+            (after, until, limit),
+        ).fetchall()
+        if after and log:
+            earlier = conn.execute(
+                "SELECT row_id, MRN, changes FROM visit_changes WHERE row_id <= ? "
+                "AND MRN IN (SELECT value FROM json_each(?)) ORDER BY row_id",
+                (after, json.dumps(list({mrn for _, mrn, _ in log}))),
+            ).fetchall()
+            log = earlier + log
+        return log
+
+    # Flat rows for the visits in log after row `after`: each patient's changes
+    # are forward-filled over their visits in row order
+    def _materialize(self, log, after):
+        names, values = self._dictionaries()
+        columns = _ordered_columns([names[column_id] for column_id in sorted(names)])
+        if not log:
+            return pd.DataFrame(columns=columns)
+        row_ids, mrns, blobs = zip(*log)
+        mrns = np.array(mrns, dtype=object)
+        keep = np.array(row_ids) > after
+        counts = np.fromiter(map(len, blobs), dtype=np.int64, count=len(blobs)) // CHANGE.itemsize
+        changes = np.frombuffer(b"".join(blobs), dtype=CHANGE)
+        # Visits ordered patient by patient (row order within a patient), so a
+        # running maximum finds each cell's last change
+        codes = pd.factorize(mrns)[0]
+        order = np.argsort(codes, kind="stable")
+        n = len(order)
+        position = np.empty(n, dtype=np.int64)
+        position[order] = np.arange(n)
+        sorted_codes = codes[order]
+        first = np.ones(n, dtype=bool)
+        first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+        patient_start = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+        change_position = np.repeat(position, counts)
+        by_column = np.argsort(changes["column"], kind="stable")
+        column_ids, bounds = np.unique(changes["column"][by_column], return_index=True)
+        bounds = list(bounds) + [len(by_column)]
+        wanted = position[keep]
+        index = {column: i for i, column in enumerate(columns)}
+        cells = np.full((len(wanted), len(columns)), None, dtype=object)
+        cells[:, index["MRN"]] = mrns[keep]
+        for i, column_id in enumerate(column_ids.tolist()):
+            selected = by_column[bounds[i]:bounds[i + 1]]
+            at = change_position[selected]
+            value_at = np.zeros(n, dtype=np.uint32)
+            value_at[at] = changes["value"][selected]
+            last = np.full(n, -1, dtype=np.int64)
+            last[at] = at
+            last = np.maximum.accumulate(last)
+            filled = np.where(last >= patient_start, value_at[np.maximum(last, 0)], 0)
+            cells[:, index[names[column_id]]] = values[filled[wanted]]
+        return pd.DataFrame(cells, columns=columns)
+
+    # Rows written after signature (up to and including until), in insertion order
+    def load_since(self, signature, until=None):
+        return self._materialize(self._read_changes(signature or 0, until), signature or 0)
+
+    # Rows up to and including until, chunk_size at a time, without holding the whole table
+    def iter_chunks(self, chunk_size=10_000, until=None):
+        last = 0
+        while True:
+            log = self._read_changes(last, until, chunk_size)
+            if not log:
+                return
+            yield self._materialize(log, last)
+            last = log[-1][0]
+
+    # Insert all rows in one transaction and return their row ids; authors, if
+    # given, names who saved each row for the audit trail
+    def append(self, rows, authors=None):
+        if not rows:
+            return []
+        conn = self._connection()
+        try:
+            with conn:
+                # Take the write lock up front so the row ids below are ours alone
+                conn.execute("BEGIN IMMEDIATE")
+                sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'visit_changes'").fetchone()
+                first_id = (sequence[0] if sequence else 0) + 1
+                row_ids = list(range(first_id, first_id + len(rows)))
+                self._write(conn, rows, row_ids, int(time.time()), authors)
+        except BaseException:
+            # Ids handed out in the rolled back transaction may be reused by others
+            with self._lock:
+                self._reset_dictionaries()
+            raise
+        return row_ids
+
+    # Audit trail of one patient: a row per changed cell, oldest first, with
+    # the value before and after and when (UTC) and by whom it was saved
+    def history(self, mrn):
+        rows = self._connection().execute(
+            "SELECT row_id, saved_at, saved_by, changes FROM visit_changes WHERE MRN = ? ORDER BY row_id", (mrn,)
+        ).fetchall()
+        names, values = self._dictionaries()
+        state, entries = {}, []
+        for row_id, saved_at, saved_by, changes in rows:
+            for column_id, value_id in np.frombuffer(changes, dtype=CHANGE).tolist():
+                entries.append((row_id, saved_at, saved_by, names[column_id], values[state.get(column_id, 0)], values[value_id]))
+                state[column_id] = value_id
+        history = pd.DataFrame(entries, columns=["row_id", "saved_at", "saved_by", "column", "before", "after"])
+        history["saved_at"] = pd.to_datetime(history["saved_at"], unit="s")
+        return history
+
+    # Last row id saved at or before `when` (naive times are UTC), for
+    # load_since(None, until) views of the registry as it stood then. Rows
+    # carried over from before the change log have no save time and always count.
+    def row_as_of(self, when):
+        timestamp = pd.Timestamp(when).timestamp()
+        return self._connection().execute(
+            "SELECT COALESCE(MAX(row_id), 0) FROM visit_changes WHERE saved_at IS NULL OR saved_at <= ?", (timestamp,)
+        ).fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        row = self._connection().execute("SELECT value FROM registry_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO registry_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM visit_changes").fetchone()[0]
+
+
+# A registry service (service.py) over HTTP, for app replicas and other
+# clients. The service owns the storage; this backend only moves rows, so the
+# RegistryStore cache, snapshots, imports and exports work on top of it as they
+# do on a local database. Rows come back in the stored (flat) format.
+class ServiceBackend:
+    name = "service"
+
+    def __init__(self, url, timeout=60):
+        self.path = url.rstrip("/")
+        self.timeout = timeout
+        self._identity = None
+
+    def _request(self, path, payload=None, **params):
+        query = urllib.parse.urlencode({key: value for key, value in params.items() if value is not None})
+        request = urllib.request.Request(
+            f"{self.path}{path}{'?' + query if query else ''}",
+            data=None if payload is None else json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            raise RuntimeError(f"registry service: {error.read().decode(errors='replace') or error}") from None
+
+    @staticmethod
+    def _frame(body):
+        cells = np.empty((len(body["rows"]), len(body["columns"])), dtype=object)
+        if body["rows"]:
+            cells[:] = body["rows"]
+        return pd.DataFrame(cells, columns=body["columns"])
+
+    def identity(self):
+        if self._identity is None:
+            self._identity = self._request("/registry")["identity"]
+        return self._identity
+
+    def signature(self):
+        return self._request("/signature")["signature"]
+
+    def columns(self):
+        return self._request("/registry")["columns"]
+
+    def load(self):
+        return self.load_since(None)
+
+    def load_since(self, signature, until=None):
+        body = self._request(
+            "/rows",
+            after=None if signature is None else json.dumps(signature),
+            until=None if until is None else json.dumps(until),
+        )
+        return None if body is None else self._frame(body)
+
+    # Row id windows of chunk_size, up to the signature when the export started;
+    # a service over a workbook has no row ids, so that is read whole and sliced
+    def iter_chunks(self, chunk_size=10_000, until=None):
+        until = self.signature() if until is None else until
+        if until is not None and not isinstance(until, int):
+            df = self.load()
+            for start in range(0, len(df), chunk_size):
+                yield df.iloc[start:start + chunk_size].reset_index(drop=True)
+            return
+        last = 0
+        while until is not None and last < until:
+            yield self.load_since(last, min(last + chunk_size, until))
+            last += chunk_size
+
+    def append(self, rows, authors=None):
+        rows = [{key: to_cell(value) for key, value in row.items()} for row in rows]
+        return self._request("/visits", {"rows": rows, "authors": authors})["row_ids"]
+
+    def history(self, mrn):
+        body = self._request("/history", mrn=mrn)
+        if body is None:
+            return None
+        history = self._frame(body)
+        history["saved_at"] = pd.to_datetime(history["saved_at"])
+        return history
+
+    def row_as_of(self, when):
+        return self._request("/as-of", when=pd.Timestamp(when).isoformat())["row_id"]
+
+    def __len__(self):
+        return self._request("/registry")["rows"]
+
+
+# database_file is the service URL for the "service" backend
+def open_backend(kind, database_file, excel_file):
+    if kind == "sqlite":
+        return SQLiteBackend(database_file)
+    if kind == "excel":
+        return ExcelBackend(excel_file)
+    if kind == "service":
+        return ServiceBackend(database_file)
+    raise ValueError(f"Unknown storage backend: {kind!r}")
+
+
+# Convert workbook rows into records ready for backend.append
+def frame_to_records(df):
+    df = df.astype(object).where(df.notna(), None)
+    return [{key: to_cell(value) for key, value in row.items()} for row in df.to_dict("records")]
+
+# Copy an existing workbook into the database once; later starts are no-ops
+def migrate_from_excel(excel_file, backend):
+    if not isinstance(backend, SQLiteBackend) or not excel_file or not os.path.exists(excel_file):
+        return 0
+    if os.path.abspath(excel_file) == os.path.abspath(backend.path):
+        return 0
+    if backend.get_meta("migrated_from") is not None or len(backend):
+        return 0
+    rows = frame_to_records(pd.read_excel(excel_file))
+    backend.append(rows)
+    backend.set_meta("migrated_from", os.path.abspath(excel_file))
+    return len(rows)
+
+def import_excel(excel_file, backend):
+    rows = frame_to_records(pd.read_excel(excel_file))
+    backend.append(rows)
+    return len(rows)
+
+def export_excel(backend, excel_file):
+    df = backend.load()
+    df.to_excel(excel_file, index=False)
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move registry data between the database and Excel workbooks.")
+    parser.add_argument("command", choices=["migrate", "import", "export"])
+    parser.add_argument("excel_file")
+    parser.add_argument("--database", default="registry.db")
+    args = parser.parse_args()
+
+    backend = SQLiteBackend(args.database)
+    if args.command == "migrate":
+        count = migrate_from_excel(args.excel_file, backend)
+    elif args.command == "import":
+        count = import_excel(args.excel_file, backend)
+    else:
+        count = export_excel(backend, args.excel_file)
+    print(f"{args.command}: {count} rows")
@@ -0,0 +1,151 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from registry_schema import (
+    CATEGORIES,
+    CTCAE_COLUMNS,
+    HISTOLOGY_OPTIONS,
+    REGISTRY_COLUMNS,
+    SYSTEMIC_TREATMENT_OPTIONS,
+)
+
+# Dose / fractionation schedules actually prescribed, with their share of patients
+SCHEDULES = [("26Gy", "1", 0.40), ("40Gy", "5", 0.25), ("35Gy", "5", 0.15), ("30Gy", "3", 0.12), ("Others", "Others", 0.08)]
+
+# Share of patients per histology, in HISTOLOGY_OPTIONS order
+HISTOLOGY_WEIGHTS = [0.70, 0.12, 0.08, 0.04, 0.06]
+
+STAGES = [["cT1a", "cN0", "M0"], ["cT1b", "cN0", "M0"], ["cT2a", "cN0", "M0"], ["cT3a", "cN0", "M0"], ["cT3a", "cN1", "M1"], ["cTx"]]
+STAGE_WEIGHTS = [0.35, 0.30, 0.12, 0.10, 0.08, 0.05]
+
+# Chance of a toxicity grade at a visit: most visits record none, few record a severe one
+GRADE_WEIGHTS = {"Absent": 0.80, "None": 0.80, "I": 0.12, "II": 0.05, "III": 0.02, "IV": 0.007, "V": 0.003}
+
+# Mean months to each event for the patients who have it, and the share who do
+EVENTS = {"Local_recurrence": (0.10, 20), "Regional_recurrence": (0.06, 24), "Distant_recurrence": (0.15, 18), "Death": (0.20, 30)}
+
+FIRST_RT_DATE = np.datetime64("2012-01-01")
+LAST_RT_DATE = np.datetime64("2024-12-31")
+
+
+def _pick(rng, options, size, weights=None):
+    options = np.asarray(options, dtype=object)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        weights = weights / weights.sum()
+    return options[rng.choice(len(options), size=size, p=weights)]
+
+def _iso(days):
+    return np.datetime_as_string(days.astype("datetime64[D]"), unit="D").astype(object)
+
+def _months(start, end):
+    start, end = start.astype("datetime64[M]").astype(int), end.astype("datetime64[M]").astype(int)
+    return end - start
+
+
+# A deterministic registry of `visits` rows in the stored format (ISO date
+# strings, list cells as "['a', 'b']"), with the real column set and the form's
+# vocabularies. Patients have 1 to ~8 follow-up visits a few months apart;
+# events, once reported, stay reported on later visits with the same months.
+def generate_registry(visits, seed=0, visits_per_patient=3.5):
+    rng = np.random.default_rng(seed)
+    patients = max(1, int(round(visits / visits_per_patient)))
+
+    # Every patient gets at least one visit; the rest are spread at random
+    patient = np.sort(np.r_[np.arange(min(patients, visits)), rng.integers(0, patients, max(0, visits - patients))])
+    first = np.r_[0, np.flatnonzero(np.diff(patient)) + 1]
+
+    mrn = (rng.choice(9_000_000, size=patients, replace=False) + 1_000_000).astype(str).astype(object)
+    rt_date = FIRST_RT_DATE + rng.integers(0, (LAST_RT_DATE - FIRST_RT_DATE).astype(int), patients)
+    age_at_rt = rng.normal(66, 10, patients).clip(30, 95)
+    birth_date = rt_date - (age_at_rt * 365.25).astype(int)
+    biopsy_date = rt_date - rng.integers(20, 120, patients)
+    schedule = rng.choice(len(SCHEDULES), size=patients, p=[weight for _, _, weight in SCHEDULES])
+
+    # Visits every 3-6 months after radiotherapy
+    gaps = rng.integers(90, 180, visits)
+    gaps[first] = rng.integers(60, 120, len(first))
+    cumulative = np.cumsum(gaps)
+    follow_up = rt_date[patient] + (cumulative - np.repeat(cumulative[first] - gaps[first], np.diff(np.r_[first, visits])))
+    months_after = _months(rt_date[patient], follow_up)
+
+    df = pd.DataFrame(index=pd.RangeIndex(visits))
+    df["MRN"] = mrn[patient]
+    df["Date_of_Birth"] = _iso(birth_date[patient])
+    df["Age"] = ((follow_up - birth_date[patient]).astype(int) // 365.25).astype(int)
+    df["Date_of_Last_Radiotherapy"] = _iso(rt_date[patient])
+    df["Follow_up_date"] = _iso(follow_up)
+    df["Follow_up_time"] = months_after
+
+    # Baseline details: chosen once per patient, repeated on each visit
+    histology = _pick(rng, HISTOLOGY_OPTIONS, patients, HISTOLOGY_WEIGHTS)
+    df["Histology"] = np.array([str([value]) for value in HISTOLOGY_OPTIONS], dtype=object)[
+        pd.Index(HISTOLOGY_OPTIONS).get_indexer(histology)][patient]
+    df["Grade"] = _pick(rng, CATEGORIES["Grade"], patients, [0.15, 0.40, 0.25, 0.05, 0.15])[patient]
+    df["Tumor_Focality"] = _pick(rng, CATEGORIES["Tumor_Focality"], patients, [0.85, 0.10, 0.05])[patient]
+    stage_cells = np.array([str(stage) for stage in STAGES], dtype=object)
+    df["Clinical_Stage"] = stage_cells[rng.choice(len(STAGES), size=patients, p=STAGE_WEIGHTS)][patient]
+    df["Type_of_Confirmatory_procedure"] = _pick(rng, CATEGORIES["Type_of_Confirmatory_procedure"], patients, [0.75, 0.05, 0.03, 0.15, 0.02])[patient]
+    df["Biopsy_date"] = _iso(biopsy_date[patient])
+
+    recurrent = rng.random(patients) < 0.15
+    df["Recurrent_Tumor"] = np.where(recurrent, "Yes", "No")[patient]
+    surgery_date = rt_date - rng.integers(365, 3650, patients)
+    df["Recurrence_date"] = np.where(recurrent, _iso(rt_date - rng.integers(30, 180, patients)), None)[patient]
+    df["Surgery_type"] = np.where(recurrent, _pick(rng, CATEGORIES["Surgery_type"], patients, [0.5, 0.4, 0.1]), None)[patient]
+    df["Surgery_date"] = np.where(recurrent, _iso(surgery_date), None)[patient]
+
+    treated = rng.random(patients) < 0.25
+    treatment = _pick(rng, SYSTEMIC_TREATMENT_OPTIONS[1:], patients, [0.1, 0.4, 0.35, 0.05, 0.05, 0.05])
+    df["Systemic_Treatment"] = np.where(treated, [str([value]) for value in treatment], str(["None"]))[patient]
+    treatment_start = rt_date + rng.integers(-365, 365, patients)
+    df["Systemic_Treatment_first_date"] = np.where(treated, _iso(treatment_start), None)[patient]
+    df["Systemic_Treatment_last_date"] = np.where(treated, _iso(treatment_start + rng.integers(30, 720, patients)), None)[patient]
+
+    df["Dose"] = np.array([str([dose]) for dose, _, _ in SCHEDULES], dtype=object)[schedule][patient]
+    df["Fractionation"] = np.array([str([fractions]) for _, fractions, _ in SCHEDULES], dtype=object)[schedule][patient]
+
+    # Per-visit toxicities
+    df["Dysuria"] = _pick(rng, CATEGORIES["Dysuria"], visits, [0.1, 0.9])
+    for column in CTCAE_COLUMNS:
+        vocabulary = CATEGORIES[column]
+        df[column] = _pick(rng, vocabulary, visits, [GRADE_WEIGHTS[grade] for grade in vocabulary])
+    df["Ureteral_Stenosis"] = _pick(rng, CATEGORIES["Ureteral_Stenosis"], visits, [0.97, 0.03])
+    df["Overal_tolerance"] = _pick(rng, CATEGORIES["Overal_tolerance"], visits, [0.5, 0.35, 0.1, 0.05])
+
+    # Events: a per-patient month of onset; reported from the first visit at or after it
+    for flag, (share, mean_months) in EVENTS.items():
+        onset = np.where(rng.random(patients) < share, np.ceil(rng.exponential(mean_months, patients)), np.inf)[patient]
+        reported = months_after >= onset
+        df[flag] = np.where(reported, "Yes", "No")
+        time_column = "time_to_" + flag.lower()
+        df[time_column] = pd.array(np.where(reported, onset, np.nan), dtype="Float64").astype("Int64")
+    cancer_related = (rng.random(patients) < 0.6)[patient]
+    df["Cancer Related Death"] = np.where((df["Death"] == "Yes") & cancer_related, "Yes", "No")
+
+    return df[[*REGISTRY_COLUMNS, "Cancer Related Death"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic registry for demos and benchmarks.")
+    parser.add_argument("visits", type=int)
+    parser.add_argument("output", help=".db (SQLite registry), .parquet (snapshot), .xlsx or .csv")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    df = generate_registry(args.visits, seed=args.seed)
+    if args.output.endswith(".db"):
+        from storage import SQLiteBackend, frame_to_records
+        backend = SQLiteBackend(args.output)
+        for start in range(0, len(df), 50_000):
+            backend.append(frame_to_records(df.iloc[start:start + 50_000]))
+    elif args.output.endswith(".parquet"):
+        from snapshot import to_typed, write_snapshot
+        write_snapshot(to_typed(df), args.output, None, None)
+    elif args.output.endswith(".xlsx"):
+        df.to_excel(args.output, index=False)
+    else:
+        df.to_csv(args.output, index=False)
+    print(f"wrote {len(df)} visits of {df['MRN'].nunique()} patients to {args.output}")
@@ -0,0 +1,61 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import registry
+from form_schema import prefill_values, validate
+
+
+@pytest.fixture
+def store(tmp_path):
+    registry.configure(database=str(tmp_path / "registry.db"), snapshot="", backend="sqlite")
+    yield registry.get_registry_store()
+    registry.configure()
+
+
+def _open(mrn):
+    at = AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"), default_timeout=60).run()
+    at.text_input(key="mrn").input(mrn).run()
+    return at
+
+def _save(at):
+    next(button for button in at.button if button.label == "Save Information").click().run()
+    assert not at.exception
+    assert [error.value for error in at.error] == []
+    assert at.success
+
+
+# A follow-up that only changes the follow-up date keeps the months to an
+# event recorded at an earlier visit
+def test_follow_up_keeps_months_to_event(store):
+    at = _open("777")
+    at.date_input(key="field_Date_of_Birth").set_value(date(1950, 3, 4))
+    at.date_input(key="field_Date_of_Last_Radiotherapy").set_value(date(2019, 1, 10))
+    at.date_input(key="field_Follow_up_date").set_value(date(2020, 1, 10)).run()
+    at.radio(key="field_Local_recurrence").set_value("Yes").run()
+    at.date_input(key="field_Local_recurrence_date").set_value(date(2019, 7, 20)).run()
+    _save(at)
+    assert registry.get_patient_data("777")["time_to_local_recurrence"] == 6
+
+    at = _open("777")
+    assert at.radio(key="field_Local_recurrence").value == "Yes"
+    at.date_input(key="field_Follow_up_date").set_value(date(2025, 10, 1)).run()
+    _save(at)
+    visits = registry.get_patient_visits("777")
+    assert len(visits) == 2
+    assert visits[-1]["time_to_local_recurrence"] == 6
+    assert visits[-1]["Follow_up_time"] == 81
+
+
+def test_event_after_follow_up_is_rejected():
+    values = {
+        "MRN": "1", "Date_of_Birth": date(1950, 1, 1), "Date_of_Last_Radiotherapy": date(2020, 1, 1),
+        "Follow_up_date": date(2021, 1, 1), "Death": "Yes", "Death_date": date(2021, 6, 1),
+    }
+    assert "Date of Death is after the Date of Follow-up." in validate({**prefill_values(), **values})
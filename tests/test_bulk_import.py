@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulk_import import map_columns, validate_chunk
+
+
+def _validate(**columns):
+    chunk = pd.DataFrame({"MRN": ["1"] * len(next(iter(columns.values()))), **columns})
+    renames, _ = map_columns(chunk.columns)
+    return validate_chunk(chunk, renames)
+
+
+# "None" is grade 0 for some toxicities and a systemic treatment option, not a missing cell
+def test_none_option_is_kept():
+    accepted, rejected = _validate(Fatigue=["None"], Cystitis=["none"], Systemic_Treatment=["None"])
+    assert rejected.empty
+    row = accepted.iloc[0]
+    assert row["Fatigue"] == "None"
+    assert row["Cystitis"] == "None"
+    assert row["Systemic_Treatment"] == "['None']"
+
+
+def test_missing_markers_are_empty_where_none_is_not_an_option():
+    accepted, rejected = _validate(Hematuria=["None", "n/a", "-", "II"], Systemic_Treatment=["N/A", "", "None; ADC", "['None']"])
+    assert rejected.empty
+    assert accepted["Hematuria"].tolist() == [None, None, None, "II"]
+    assert accepted["Systemic_Treatment"].tolist() == [None, None, "['None', 'ADC']", "['None']"]
+
+
+def test_values_outside_the_vocabulary_are_rejected():
+    accepted, rejected = _validate(Fatigue=["Grade I", "I"], Systemic_Treatment=["Surgery", "ADC"])
+    assert accepted["Fatigue"].tolist() == ["I"]
+    assert rejected["Source_row"].tolist() == [2]
+    assert "Fatigue: not one of the form options" in rejected["Errors"].iloc[0]
+    assert "Systemic_Treatment: not one of the form options" in rejected["Errors"].iloc[0]
@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import registry
+
+THREADS = 16
+# The workbook is rewritten on every commit, so it gets fewer saves
+SAVES_PER_THREAD = {"sqlite": 20, "excel": 2}
+
+
+# Point the registry at a fresh store in tmp_path, without a snapshot
+@pytest.fixture(params=["sqlite", "excel"])
+def store(request, tmp_path):
+    registry.configure(
+        database=str(tmp_path / "registry.db"),
+        excel=str(tmp_path / "registry.xlsx"),
+        snapshot="",
+        backend=request.param,
+    )
+    yield registry.get_registry_store()
+    registry.get_registry_store().writer.close()
+
+
+# N threads saving at once through save_data must leave exactly N rows in the
+# storage, in the cached frame and in the visit index
+def test_concurrent_saves_keep_every_row(store):
+    per_thread = SAVES_PER_THREAD[store.backend.name]
+    saves = THREADS * per_thread
+    start = threading.Barrier(THREADS)
+    receipts = []
+    errors = []
+
+    def worker(thread):
+        start.wait()
+        try:
+            for i in range(per_thread):
+                receipts.append(registry.save_data({
+                    "MRN": f"{thread:03d}{i:04d}",
+                    "Follow_up_date": "2024-01-01",
+                    "Hematuria": "I",
+                }, author=f"thread {thread}"))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=worker, args=(thread,)) for thread in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(receipts) == saves
+    if store.backend.name == "sqlite":
+        assert len({receipt.row_id for receipt in receipts}) == saves
+    # Saves that queued up together were committed together
+    assert store.writer.batches < saves
+    assert len(store.backend) == saves
+    assert store.row_count() == saves
+    assert len(store.data()) == saves
+    assert sum(len(store.index.visits(mrn)) for mrn in store.index.mrns()) == saves
+    assert all(registry.patient_exists(f"{thread:03d}{i:04d}") for thread in range(THREADS) for i in range(per_thread))
+
+    # A fresh store reading the same storage sees the same rows
+    store.invalidate()
+    assert len(store.data()) == saves
@@ -0,0 +1,97 @@
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import registry
+from registry import RegistryStore
+from service import RegistryServer
+from storage import ServiceBackend, SQLiteBackend
+
+
+# A service on a free local port over a fresh database, and its URL
+@pytest.fixture
+def service(tmp_path):
+    registry.configure(snapshot="")
+    store = RegistryStore(SQLiteBackend(str(tmp_path / "registry.db")))
+    server = RegistryServer(("127.0.0.1", 0), store, workers=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield store, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    store.writer.close()
+
+
+# App stores reading and saving through the service, as replicas do
+@pytest.fixture
+def replicas(service):
+    _, url = service
+    stores = [RegistryStore(ServiceBackend(url)) for _ in range(2)]
+    yield stores
+    for store in stores:
+        store.writer.close()
+
+
+def _post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode())
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_save_and_lookup_through_replicas(service, replicas):
+    store, url = service
+    a, b = replicas
+    receipt = a.append({"MRN": " 42 ", "Follow_up_date": "2024-01-01", "Hematuria": "I"}, author="a")
+    assert receipt.row_id == 1
+    assert a.get_patient("42")["Hematuria"] == "I"
+    # The other replica catches up on its next read
+    assert b.get_patient("42")["Hematuria"] == "I"
+    b.append({"MRN": "42", "Follow_up_date": "2024-06-01", "Hematuria": "II"}, author="b")
+    assert [visit["Hematuria"] for visit in a.get_visits("42")] == ["I", "II"]
+    assert store.get_patient("42")["Hematuria"] == "II"
+    assert list(a.history("42")["saved_by"].unique()) == ["a", "b"]
+
+    status, body = _post(f"{url}/patients", {"mrns": ["42", "missing"]})
+    assert status == 200
+    assert body["patients"]["42"]["Hematuria"] == "II"
+    assert body["patients"]["42"]["Follow_up_date"] == "2024-06-01"
+    assert body["patients"]["missing"] is None
+
+
+def test_invalid_batch_is_rejected_whole(service, replicas):
+    store, url = service
+    rows = [{"MRN": "1", "Hematuria": "II"}, {"MRN": "2", "Hematuria": "Absent: No change"}]
+    status, body = _post(f"{url}/visits", {"rows": rows, "authors": ["x", "x"]})
+    assert status == 400
+    assert "row 1: Hematuria: not one of the form options" in body["error"]
+    status, body = _post(f"{url}/visits", {"rows": [{"MRN": "3", "Unknown": 1}]})
+    assert status == 400
+    assert len(store.backend) == 0
+    assert not store.has_patient("1")
+    with pytest.raises(RuntimeError):
+        replicas[0].append({"MRN": "4", "Fatigue": "IV"})
+    assert len(store.backend) == 0
+
+
+def test_as_of_converts_offsets_to_utc(service, replicas):
+    store, url = service
+    replicas[0].append({"MRN": "1", "Hematuria": "I"})
+    saved_at = store.history("1")["saved_at"].iloc[0]
+    before = (saved_at - pd.Timedelta(minutes=2)).tz_localize("UTC").tz_convert("Etc/GMT-5").isoformat()
+    after = (saved_at + pd.Timedelta(minutes=2)).tz_localize("UTC").tz_convert("Etc/GMT+5").isoformat()
+    assert "+05:00" in before and "-05:00" in after
+    for when, row_id in [(before, 0), (after, 1)]:
+        with urllib.request.urlopen(f"{url}/as-of?{urllib.parse.urlencode({'when': when})}") as response:
+            assert json.loads(response.read())["row_id"] == row_id
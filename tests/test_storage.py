@@ -0,0 +1,125 @@
+import os
+import random
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from registry_schema import REGISTRY_COLUMNS
+from storage import SQLiteBackend, _quote
+
+
+# Visits of a few patients, interleaved, with cells left empty at random and
+# a column outside the schema on some of them
+def _visits(count=300, seed=7):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        row = {"MRN": f"P{rng.randrange(40):03d}", "Follow_up_date": f"2024-{rng.randint(1, 12):02d}-01"}
+        for column in ["Date_of_Birth", "Histology", "Hematuria", "Fatigue", "Age", "Follow_up_time"]:
+            if rng.random() < 0.7:
+                row[column] = rng.choice(["1950-01-02", "['Renal Cell Carcinoma']", "I", "II", "None", 61, 12])
+        if i % 7 == 0:
+            row["Notes"] = f"note {i}"
+        rows.append(row)
+    return rows
+
+# What load() should return for rows: every column, None where a row has no value
+def _expected(rows, columns):
+    return pd.DataFrame([[row.get(column) for column in columns] for row in rows], columns=columns, dtype=object)
+
+def _assert_same(df, rows):
+    expected = _expected(rows, list(df.columns))
+    pd.testing.assert_frame_equal(df.reset_index(drop=True).astype(object), expected, check_dtype=False)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteBackend(str(tmp_path / "registry.db"))
+
+
+def test_round_trip_with_missing_cells_and_extra_columns(backend):
+    rows = _visits()
+    row_ids = backend.append(rows[:100], ["a"] * 100)
+    row_ids += backend.append(rows[100:])
+    assert row_ids == list(range(1, len(rows) + 1))
+    df = backend.load()
+    assert list(df.columns[:len(REGISTRY_COLUMNS)]) == REGISTRY_COLUMNS
+    assert "Notes" in df.columns
+    _assert_same(df, rows)
+    assert len(backend) == len(rows)
+    # A fresh backend (empty dictionary caches) reads the same
+    _assert_same(SQLiteBackend(backend.path).load(), rows)
+
+
+@pytest.mark.parametrize("after,until", [(None, 1), (0, 17), (1, 2), (17, 133), (133, None), (299, 300), (300, None)])
+def test_load_since_at_any_offset(backend, after, until):
+    rows = _visits()
+    backend.append(rows)
+    _assert_same(backend.load_since(after, until), rows[after or 0:until])
+
+
+@pytest.mark.parametrize("chunk_size,until", [(1, 5), (7, None), (64, 250), (1000, None)])
+def test_iter_chunks(backend, chunk_size, until):
+    rows = _visits()
+    backend.append(rows)
+    chunks = list(backend.iter_chunks(chunk_size, until))
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    _assert_same(pd.concat(chunks), rows[:until])
+
+
+def test_history_records_before_and_after(backend):
+    backend.append([{"MRN": "1", "Hematuria": "I", "Fatigue": "None"}], ["alice"])
+    backend.append([{"MRN": "2", "Hematuria": "III"}], ["carol"])
+    backend.append([{"MRN": "1", "Hematuria": "II", "Fatigue": "None", "Age": 61}], ["bob"])
+    backend.append([{"MRN": "1", "Hematuria": "II"}], ["bob"])
+    history = backend.history("1")
+    changes = list(history[["row_id", "saved_by", "column", "before", "after"]].itertuples(index=False, name=None))
+    # The MRN keys the log rather than being one of its changes
+    assert changes == [
+        (1, "alice", "Hematuria", None, "I"),
+        (1, "alice", "Fatigue", None, "None"),
+        (3, "bob", "Hematuria", "I", "II"),
+        (3, "bob", "Age", None, 61),
+        (4, "bob", "Fatigue", "None", None),
+        (4, "bob", "Age", 61, None),
+    ]
+    assert history["saved_at"].notna().all()
+    assert backend.history("unknown").empty
+
+
+# A database from before the change log: one full row per visit in `visits`
+def test_migration_from_the_wide_table(tmp_path):
+    path = str(tmp_path / "registry.db")
+    rows = _visits(120)
+    columns = [*REGISTRY_COLUMNS, "Notes"]
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE visits (row_id INTEGER PRIMARY KEY AUTOINCREMENT, {', '.join(_quote(column) for column in columns)})")
+    for row in rows:
+        conn.execute(f"INSERT INTO visits ({', '.join(_quote(key) for key in row)}) VALUES ({', '.join('?' for _ in row)})", list(row.values()))
+    # Row ids with a gap, as left by deleted rows
+    conn.execute("DELETE FROM visits WHERE row_id = 5")
+    conn.commit()
+    conn.close()
+    kept = rows[:4] + rows[5:]
+
+    backend = SQLiteBackend(path)
+    _assert_same(backend.load(), kept)
+    assert backend.signature() == 120
+    _assert_same(backend.load_since(4, 10), rows[5:10])
+    tables = {name for (name,) in backend._connection().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "visits" not in tables
+
+    # The database as it was is kept next to it, and recorded
+    backup_path = path + ".before-change-log"
+    assert backend.get_meta("migration_backup") == os.path.abspath(backup_path)
+    backup = sqlite3.connect(backup_path)
+    assert backup.execute("SELECT COUNT(*) FROM visits").fetchone()[0] == len(kept)
+    backup.close()
+
+    # Later starts leave the converted database alone
+    backend.append([{"MRN": "new"}])
+    _assert_same(SQLiteBackend(path).load(), kept + [{"MRN": "new"}])
@@ -0,0 +1,99 @@
+import bisect
+
+import numpy as np
+import pandas as pd
+
+
+# Visits without a usable follow-up date sort before every dated one
+UNDATED = -(2 ** 62)
+
+# Sort key for a follow-up date: days since 1970-01-01, or UNDATED when the
+# value is missing or unparseable
+def date_key(value):
+    if value is None or value == "":
+        return UNDATED
+    timestamp = pd.to_datetime(value, errors="coerce")
+    if pd.isna(timestamp):
+        return UNDATED
+    return int(timestamp.normalize().value // 86_400_000_000_000)
+
+def _date_keys(values):
+    days = pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[D]").astype(np.int64)
+    days[days == np.iinfo(np.int64).min] = UNDATED
+    return days
+
+# ISO date for a sort key, "" for undated visits
+def key_to_date(key):
+    if key == UNDATED:
+        return ""
+    return str(np.datetime64(key, "D"))
+
+
+# Index from normalized MRN to that patient's visits, ordered by Follow_up_date.
+# Each patient maps to a sorted list of (date_key, position) where position is
+# the row number in the registry; ties keep save order, so the last entry is
+# always the most recent visit.
+class VisitIndex:
+    def __init__(self):
+        self._visits = {}
+
+    # Build the index for a whole frame in one vectorized sort
+    @classmethod
+    def from_frame(cls, df, start=0):
+        index = cls()
+        index.extend(df, start)
+        return index
+
+    # Add every row of df, numbered from start
+    def extend(self, df, start=0):
+        if not len(df):
+            return
+        codes, mrns = pd.factorize(df["MRN"].astype(str))
+        keys = _date_keys(df["Follow_up_date"])
+        positions = np.arange(start, start + len(df))
+        order = np.lexsort((positions, keys, codes))
+        codes, keys, positions = codes[order], keys[order], positions[order]
+        boundaries = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        for lo, hi in zip(np.r_[0, boundaries].tolist(), np.r_[boundaries, len(codes)].tolist()):
+            entries = list(zip(keys[lo:hi].tolist(), positions[lo:hi].tolist()))
+            mrn = mrns[codes[lo]]
+            existing = self._visits.get(mrn)
+            if existing is None:
+                self._visits[mrn] = entries
+            else:
+                for entry in entries:
+                    bisect.insort(existing, entry)
+
+    # Record one saved visit
+    def add(self, mrn, follow_up_date, position):
+        bisect.insort(self._visits.setdefault(mrn, []), (date_key(follow_up_date), position))
+
+    # Position of the most recent visit, or None for an unknown MRN
+    def latest(self, mrn):
+        visits = self._visits.get(mrn)
+        return visits[-1][1] if visits else None
+
+    # Positions of all visits, oldest first
+    def visits(self, mrn):
+        return [position for _, position in self._visits.get(mrn, [])]
+
+    # Position of the latest visit on or before on_date, or None
+    def visit_at(self, mrn, on_date):
+        visits = self._visits.get(mrn)
+        if not visits:
+            return None
+        i = bisect.bisect_right(visits, (date_key(on_date), float("inf")))
+        return visits[i - 1][1] if i else None
+
+    # Follow-up dates of all visits as ISO strings, oldest first
+    def dates(self, mrn):
+        return [key_to_date(key) for key, _ in self._visits.get(mrn, [])]
+
+    def mrns(self):
+        return self._visits.keys()
+
+    def __contains__(self, mrn):
+        return mrn in self._visits
+
+    def __len__(self):
+        return len(self._visits)
@@ -0,0 +1,95 @@
+import atexit
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+
+# Acknowledgement handed back to each save once its row is durable
+SaveReceipt = namedtuple("SaveReceipt", ["row_id", "batch_size"])
+
+_STOP = object()
+
+
+# Single background thread that owns every write to the registry.
+# Sessions submit rows and wait on a Future; the thread drains whatever is
+# queued at that moment (up to max_batch rows) and commits it in one call, so
+# concurrent saves are serialized without losing rows and share one
+# transaction instead of paying for one each. Bulk writers submit a whole
+# chunk at once, which is committed in one call of its own size.
+class GroupCommitWriter:
+    def __init__(self, commit, max_batch=256):
+        # commit(rows) must store all rows atomically and return one row id per row (or None)
+        self._commit = commit
+        self.max_batch = max_batch
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="registry-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # Queue a row for the next group commit; the Future resolves to a SaveReceipt
+    def submit(self, row):
+        future = Future()
+        self._queue.put(([row], future, True))
+        return future
+
+    # Queue many rows to be committed together; the Future resolves to a list
+    # of SaveReceipts, one per row
+    def submit_many(self, rows):
+        future = Future()
+        if not rows:
+            future.set_result([])
+            return future
+        self._queue.put((list(rows), future, False))
+        return future
+
+    # Saves waiting for the next group commit
+    def pending(self):
+        return self._queue.qsize()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is _STOP:
+            return None
+        batch = [item]
+        size = len(item[0])
+        while size < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Commit what we have, then stop on the next call
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            rows = [row for entry_rows, _, _ in batch for row in entry_rows]
+            try:
+                row_ids = self._commit(rows)
+            except BaseException as error:
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            self.batches += 1
+            self.rows += len(rows)
+            receipts = [SaveReceipt(row_id, len(rows)) for row_id in row_ids or [None] * len(rows)]
+            start = 0
+            for entry_rows, future, single in batch:
+                entry = receipts[start:start + len(entry_rows)]
+                start += len(entry_rows)
+                future.set_result(entry[0] if single else entry)
+
+    # Flush pending saves and stop the thread
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()